@@ -1,11 +1,23 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 import google.generativeai as genai
 import os
 from dotenv import load_dotenv
+import cProfile
+import inspect
+import io
 import json
-import re
 import logging
+import pstats
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import Registry
+from quiz_cache import QuizCache, SingleFlight, WaitersFull, cache_key, normalize_topic
+from quiz_parser import QuestionStreamParser, QuizParseError, parse_batch_response, parse_quiz_response, validate_quiz
+from quiz_pool import QuizPool
+from storage import QuestionNotReady, QuizCompleted, SessionLimits, SessionNotFound, create_store, new_id
+from upstream import UpstreamGate, UpstreamSaturated, UpstreamTimeout
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +29,31 @@ CORS(app)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Metrics exposed on /metrics in Prometheus format (per worker process)
+metrics = Registry()
+http_request_seconds = metrics.histogram(
+    'quiz_http_request_seconds', 'Time spent handling each HTTP request', ('method', 'route', 'status'))
+model_call_seconds = metrics.histogram(
+    'quiz_model_call_seconds', 'Time spent waiting on Gemini, by kind of call', ('kind',))
+stream_first_question_seconds = metrics.histogram(
+    'quiz_stream_first_question_seconds', 'Time from starting a streamed quiz to its first parsed question')
+parse_seconds = metrics.histogram(
+    'quiz_parse_seconds', 'Time spent extracting and validating quiz JSON from model replies', ('kind',),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+session_create_seconds = metrics.histogram(
+    'quiz_session_create_seconds', 'Time spent storing a new quiz session',
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+quiz_fallbacks = metrics.counter(
+    'quiz_fallbacks_total', 'Quiz generations that ended with the mock quiz, by reason', ('reason',))
+model_tokens = metrics.counter(
+    'quiz_model_tokens_total', 'Gemini tokens used, when the SDK reports usage', ('kind', 'type'))
+
+# Opt-in profiling: a PROFILE_SAMPLE_RATE fraction of requests run under
+# cProfile, and the ones slower than PROFILE_SLOW_MS log their hottest calls.
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', 1000))
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', 25))
+
 # Configure Gemini API
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 if GEMINI_API_KEY:
@@ -26,9 +63,588 @@ else:
     logger.warning("GEMINI_API_KEY not found. Using mock responses.")
     model = None
 
-# In-memory storage for demo purposes
-profiles = {}
-quiz_sessions = {}
+# At most GEMINI_MAX_CONCURRENT model calls run at once. Requests that can't
+# get a slot within GEMINI_ACQUIRE_TIMEOUT seconds get the mock quiz (or a
+# 503 when UPSTREAM_SATURATED_RESPONSE=503) instead of tying up a worker thread.
+upstream = UpstreamGate(
+    max_concurrent=int(os.getenv('GEMINI_MAX_CONCURRENT', 8)),
+    acquire_timeout=float(os.getenv('GEMINI_ACQUIRE_TIMEOUT', 2)),
+    call_timeout=float(os.getenv('GEMINI_TIMEOUT', 30))
+)
+UPSTREAM_SATURATED_RESPONSE = os.getenv('UPSTREAM_SATURATED_RESPONSE', 'mock')
+
+def json_generation_config():
+    """Ask Gemini for a pure JSON reply when the installed SDK supports it."""
+    if os.getenv('GEMINI_JSON_MODE', 'true').lower() != 'true':
+        return None
+    try:
+        fields = genai.types.GenerationConfig.__annotations__
+    except AttributeError:
+        return None
+    if 'response_mime_type' not in fields:
+        return None
+    return {'response_mime_type': 'application/json'}
+
+GENERATION_CONFIG = json_generation_config()
+
+def sdk_request_options():
+    """Pass GEMINI_TIMEOUT to the SDK itself when it accepts request options."""
+    try:
+        parameters = inspect.signature(genai.GenerativeModel.generate_content).parameters
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if 'request_options' not in parameters:
+        return None
+    return {'timeout': upstream.call_timeout}
+
+REQUEST_OPTIONS = sdk_request_options()
+
+# Model responses are logged truncated, and only a sample of them at INFO
+MODEL_LOG_SAMPLE_RATE = float(os.getenv('MODEL_LOG_SAMPLE_RATE', 0.05))
+MODEL_LOG_MAX_CHARS = int(os.getenv('MODEL_LOG_MAX_CHARS', 500))
+
+# Profiles and quiz sessions. Use the sqlite backend when running more than
+# one worker process so every worker sees the same data.
+store = create_store(
+    os.getenv('STORAGE_BACKEND', 'memory'),
+    sqlite_path=os.getenv('SQLITE_PATH', 'quiz.db'),
+    limits=SessionLimits(
+        max_sessions=int(os.getenv('SESSION_MAX', 10000)),
+        idle_timeout=int(os.getenv('SESSION_IDLE_TIMEOUT', 1800)),
+        completed_ttl=int(os.getenv('SESSION_COMPLETED_TTL', 600)),
+        sweep_interval=int(os.getenv('SESSION_SWEEP_INTERVAL', 30))
+    )
+)
+
+# Generated quizzes, shared across profiles with the same topic and age band
+quiz_cache = QuizCache(
+    max_size=int(os.getenv('QUIZ_CACHE_SIZE', 512)),
+    ttl=int(os.getenv('QUIZ_CACHE_TTL', 3600)),
+    variants=int(os.getenv('QUIZ_CACHE_VARIANTS', 1))
+)
+
+# Concurrent requests for the same topic and age band share one model call.
+# Duplicates waiting longer than this many seconds get the mock quiz instead.
+QUIZ_INFLIGHT_TIMEOUT = float(os.getenv('QUIZ_INFLIGHT_TIMEOUT', 20))
+# Each waiter holds a request thread, so only this many may wait at once
+# (keep it well below GUNICORN_THREADS); the rest get the mock quiz at once.
+QUIZ_INFLIGHT_MAX_WAITERS = int(os.getenv('QUIZ_INFLIGHT_MAX_WAITERS', 8))
+quiz_inflight = SingleFlight(max_waiters=QUIZ_INFLIGHT_MAX_WAITERS)
+
+# Batch generation asks for several topics per model call
+QUIZ_BATCH_MAX_ITEMS = int(os.getenv('QUIZ_BATCH_MAX_ITEMS', 30))
+QUIZ_BATCH_TOPICS_PER_PROMPT = int(os.getenv('QUIZ_BATCH_TOPICS_PER_PROMPT', 4))
+# Batch prompts are sent side by side, still limited by the upstream gate
+batch_executor = ThreadPoolExecutor(max_workers=upstream.max_concurrent, thread_name_prefix='quiz-batch')
+
+# Questions asked for in every quiz prompt
+QUIZ_QUESTION_COUNT = 4
+
+QUESTION_FORMAT = """{
+                "question": "Exciting question that makes kids curious?",
+                "options": ["Fun first option", "Amazing second option", "Cool third option", "Awesome fourth option"],
+                "correct_answer": 0,
+                "explanation": "Wow! That's right! Here's why this is so amazing and what makes it special for kids to understand..."
+            }"""
+
+def quiz_prompt_rules(age, per_topic=False):
+    """Requirements shared by every quiz prompt, single or batched."""
+    count = f"exactly {QUIZ_QUESTION_COUNT} multiple choice questions"
+    if per_topic:
+        count += " per topic"
+    return f"""
+    IMPORTANT REQUIREMENTS:
+    - Generate {count}
+    - Each question should have 4 options (A, B, C, D)
+    - Use simple, clear language perfect for a {age}-year-old
+    - Make questions engaging with "Did you know..." or "Can you guess..." style
+    - Include fun facts and surprising information
+    - Use emojis and exciting language where appropriate
+    - Make explanations encouraging and educational
+    - Avoid scary, negative, or complex topics
+    - Focus on wonder, discovery, and positive learning
+
+    CONTENT GUIDELINES:
+    - Questions should spark curiosity and imagination
+    - Include relatable examples from a child's world
+    - Make learning feel like an adventure
+    - Use positive, encouraging tone throughout
+    - Explanations should teach something new and exciting
+    """
+
+def build_quiz_prompt(topic, age):
+    return f"""
+    You are Quizzy, a friendly and enthusiastic AI teacher who loves helping children learn!
+    Create an amazing, fun quiz about "{topic}" for a {age}-year-old child.
+    {quiz_prompt_rules(age)}
+    Return the response in this exact JSON format:
+    {{
+        "questions": [
+            {QUESTION_FORMAT}
+        ]
+    }}
+    """
+
+def build_batch_quiz_prompt(topics, age):
+    """One prompt for several quizzes, so the shared rules are only sent once."""
+    topic_list = "\n".join(f'    {i + 1}. "{topic}"' for i, topic in enumerate(topics))
+    return f"""
+    You are Quizzy, a friendly and enthusiastic AI teacher who loves helping children learn!
+    Create an amazing, fun quiz for a {age}-year-old child about EACH of these topics:
+{topic_list}
+    {quiz_prompt_rules(age, per_topic=True)}
+    Return the response in this exact JSON format, with one entry in "quizzes" per topic, in the same order:
+    {{
+        "quizzes": [
+            {{
+                "topic": "The topic exactly as given above",
+                "questions": [
+                    {QUESTION_FORMAT}
+                ]
+            }}
+        ]
+    }}
+    """
+
+def build_mock_quiz(topic):
+    return {
+        "questions": [
+            {
+                "question": f"🌟 Did you know that {topic} can be super exciting? What makes {topic} so amazing?",
+                "options": ["It's full of surprises! ✨", "It helps us learn cool things! 🧠", "It's fun to explore! 🔍", "All of these awesome things! 🎉"],
+                "correct_answer": 3,
+                "explanation": f"Wow! You're absolutely right! {topic} is full of surprises, helps us learn amazing things, and is so much fun to explore! You're such a smart learner! 🌟"
+            },
+            {
+                "question": f"🤔 If you could tell your best friend about {topic}, what would you say?",
+                "options": ["It's boring 😴", "It's the most exciting thing ever! 🚀", "It's too hard to understand 😕", "I don't care about it 🤷"],
+                "correct_answer": 1,
+                "explanation": f"Yes! {topic} really IS the most exciting thing ever! There's so much to discover and learn. Your enthusiasm for learning is fantastic! 🎊"
+            },
+            {
+                "question": f"🎯 What's the most fun way to learn about {topic}?",
+                "options": ["Reading colorful books 📚", "Watching awesome videos 📺", "Asking lots of questions ❓", "Doing all of these amazing things! 🌈"],
+                "correct_answer": 3,
+                "explanation": "Outstanding choice! The best learners use ALL these ways - books, videos, and asking questions! You're becoming a learning superhero! 🦸‍♀️🦸‍♂️"
+            },
+            {
+                "question": f"💫 Why do you think learning about {topic} is important for kids like you?",
+                "options": ["It helps us understand our amazing world 🌍", "It's super fun and exciting 🎈", "It makes us smarter and more curious 🧠", "All of these incredible reasons! ⭐"],
+                "correct_answer": 3,
+                "explanation": f"Perfect! Learning about {topic} does ALL these wonderful things! It helps you understand the world, brings joy and excitement, and makes you smarter and more curious every day! Keep being awesome! 🏆"
+            }
+        ]
+    }
+
+def log_model_response(label, text):
+    text = text or ''
+    if len(text) > MODEL_LOG_MAX_CHARS:
+        text = f"{text[:MODEL_LOG_MAX_CHARS]}... [{len(text)} chars]"
+    if random.random() < MODEL_LOG_SAMPLE_RATE:
+        logger.info(f"{label}: {text!r}")
+    else:
+        logger.debug(f"{label}: {text!r}")
+
+def record_token_usage(response, kind):
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return
+    for token_type, field in (('prompt', 'prompt_token_count'), ('output', 'candidates_token_count')):
+        count = getattr(usage, field, 0) or 0
+        if count:
+            model_tokens.inc(count, kind=kind, type=token_type)
+
+def call_model(prompt, stream=False, kind='single'):
+    """Send a prompt to Gemini, in JSON mode where available.
+
+    Both kinds go through the upstream gate and are bounded by GEMINI_TIMEOUT.
+    A stream is an iterator of chunks that only takes its slot once the
+    caller starts reading it. model_call_seconds is measured inside the gate,
+    from when the slot is held to when Gemini is done, so time spent waiting
+    for a slot (or refused one) isn't counted as Gemini time.
+    """
+    kwargs = {}
+    if GENERATION_CONFIG is not None:
+        kwargs['generation_config'] = GENERATION_CONFIG
+    if REQUEST_OPTIONS is not None:
+        kwargs['request_options'] = REQUEST_OPTIONS
+
+    if stream:
+        def timed_stream():
+            started = time.perf_counter()
+            try:
+                yield from model.generate_content(prompt, stream=True, **kwargs)
+            finally:
+                model_call_seconds.observe(time.perf_counter() - started, kind='stream')
+        return upstream.stream(timed_stream)
+
+    def timed_call():
+        with model_call_seconds.time(kind=kind):
+            return model.generate_content(prompt, **kwargs)
+
+    response = upstream.call(timed_call)
+    record_token_usage(response, kind)
+    return response
+
+def failure_reason(error):
+    """The quiz_fallbacks_total reason for a failed model call."""
+    if isinstance(error, QuizParseError):
+        return error.reason
+    if isinstance(error, UpstreamSaturated):
+        return 'saturated'
+    if isinstance(error, UpstreamTimeout):
+        return 'timeout'
+    return 'api_error'
+
+def generate_quiz_with_model(topic, age):
+    """Ask Gemini for a quiz. Returns (quiz data, None), or (None, reason) on any failure.
+
+    Raises UpstreamSaturated when no upstream slot frees up in time, so the
+    caller can choose between the mock quiz and a 503. Callers that serve
+    the mock quiz count it in quiz_fallbacks_total with the reason.
+    """
+    if model is None:
+        return None, 'no_model'
+
+    try:
+        response = call_model(build_quiz_prompt(topic, age))
+        log_model_response("Gemini API response", response.text)
+
+        with parse_seconds.time(kind='single'):
+            quiz_data, dropped = parse_quiz_response(response.text)
+        if dropped:
+            logger.warning(f"Dropped {dropped} malformed questions from quiz about {topic!r}")
+
+        return quiz_data, None
+
+    except UpstreamSaturated:
+        raise
+    except QuizParseError as parse_error:
+        logger.error(f"Unusable Gemini response ({parse_error.reason}): {parse_error}, falling back to mock data")
+        return None, parse_error.reason
+    except Exception as api_error:
+        logger.error(f"Gemini API error: {api_error}, falling back to mock data")
+        return None, failure_reason(api_error)
+
+def generate_quizzes_with_model(topics, age):
+    """Ask Gemini for quizzes on several topics in one call.
+
+    Returns (quizzes, reason): a dict of normalized topic -> quiz data for
+    each quiz that passed validation, and why the topics missing from it
+    (everything, on any failure) fall back to the mock quiz.
+    """
+    if not topics:
+        return {}, None
+    if model is None:
+        return {}, 'no_model'
+
+    try:
+        response = call_model(build_batch_quiz_prompt(topics, age), kind='batch')
+        log_model_response("Gemini API batch response", response.text)
+        with parse_seconds.time(kind='batch'):
+            quizzes = parse_batch_response(response.text)
+
+    except QuizParseError as parse_error:
+        logger.error(f"Unusable Gemini batch response ({parse_error.reason}): {parse_error}, falling back to mock data")
+        return {}, parse_error.reason
+    except Exception as api_error:
+        logger.error(f"Gemini API batch error: {api_error}, falling back to mock data")
+        return {}, failure_reason(api_error)
+
+    results = {}
+    wanted = {normalize_topic(topic) for topic in topics}
+    for index, quiz_data in enumerate(quizzes):
+        if not isinstance(quiz_data, dict):
+            continue
+        topic_key = normalize_topic(str(quiz_data.get('topic', '')))
+        if topic_key not in wanted and index < len(topics):
+            # The model reworded the topic; trust the requested order instead
+            topic_key = normalize_topic(topics[index])
+        try:
+            quiz_data, _ = validate_quiz(quiz_data)
+        except QuizParseError:
+            logger.error(f"Invalid quiz for batch topic {topic_key!r}, using mock data")
+            continue
+        results.setdefault(topic_key, quiz_data)
+
+    return results, 'bad_structure'
+
+def generate_pooled_quiz(topic, age):
+    # Not a fallback when this fails: no child is waiting on a pool refill
+    try:
+        return generate_quiz_with_model(topic, age)[0]
+    except UpstreamSaturated:
+        # Live requests have the slots; the pool retries on its next refill
+        return None
+
+# Background workers keep a few ready quizzes for popular topics and the
+# interests children pick, so those never wait on the model.
+QUIZ_POOL_ENABLED = os.getenv('QUIZ_POOL_ENABLED', 'true').lower() == 'true'
+quiz_pool = QuizPool(
+    generate_pooled_quiz,
+    target=int(os.getenv('QUIZ_POOL_TARGET', 3)),
+    low_water=int(os.getenv('QUIZ_POOL_LOW_WATER', 1)),
+    workers=int(os.getenv('QUIZ_POOL_WORKERS', 2)),
+    rate_per_minute=float(os.getenv('QUIZ_POOL_RATE_PER_MINUTE', 30)),
+    max_keys=int(os.getenv('QUIZ_POOL_MAX_KEYS', 256))
+)
+# Interests past this many on one profile aren't pre-generated
+QUIZ_POOL_INTERESTS_PER_PROFILE = int(os.getenv('QUIZ_POOL_INTERESTS_PER_PROFILE', 5))
+
+def warm_quiz_pool(topics, age, limit=None):
+    if not (QUIZ_POOL_ENABLED and model is not None):
+        return
+    if not isinstance(topics, list):
+        return
+    topics = [topic for topic in topics if isinstance(topic, str) and topic.strip()]
+    for topic in topics[:limit]:
+        quiz_pool.register(topic, age)
+
+def prefill_quiz_pool():
+    topics = [t.strip() for t in os.getenv('QUIZ_POOL_TOPICS', 'animals,space,dinosaurs,ocean').split(',')]
+    for age in os.getenv('QUIZ_POOL_AGES', '6,8,10').split(','):
+        warm_quiz_pool(topics, int(age))
+
+def get_ready_quiz(topic, age):
+    """Return (quiz, source) from the cache or the warm pool, or (None, None)."""
+    key = cache_key(topic, age)
+    quiz_data = quiz_cache.get(key)
+    if quiz_data is not None:
+        logger.info(f"Quiz cache hit for {key}")
+        return quiz_data, 'cache'
+
+    if QUIZ_POOL_ENABLED:
+        quiz_data = quiz_pool.pop(topic, age)
+        if quiz_data is not None:
+            logger.info(f"Quiz pool hit for {key}")
+            quiz_cache.put(key, quiz_data)
+            return quiz_data, 'pool'
+
+    return None, None
+
+def get_or_generate_quiz(topic, age):
+    """Return a ready quiz, or generate one with at most one model call per key.
+
+    Returns (quiz, None), or (None, reason) when the model is unavailable,
+    fails, or a duplicate request waited longer than QUIZ_INFLIGHT_TIMEOUT
+    for the call in flight (or QUIZ_INFLIGHT_MAX_WAITERS requests were
+    already waiting). Every waiter gets the leader's result, reason included.
+    """
+    quiz_data, _ = get_ready_quiz(topic, age)
+    if quiz_data is not None:
+        return quiz_data, None
+
+    key = cache_key(topic, age)
+
+    def generate():
+        quiz_data, reason = generate_quiz_with_model(topic, age)
+        if quiz_data is not None:
+            quiz_cache.put(key, quiz_data)
+        return quiz_data, reason
+
+    try:
+        return quiz_inflight.do(key, generate, timeout=QUIZ_INFLIGHT_TIMEOUT)
+    except WaitersFull:
+        logger.warning(f"Too many requests waiting on in-flight quizzes, using mock data for {key}")
+        return None, 'inflight_full'
+    except TimeoutError:
+        logger.warning(f"Timed out waiting for in-flight quiz {key}, using mock data")
+        return None, 'inflight_timeout'
+
+def create_quiz_session(profile_id, topic, questions, generating=False):
+    session_id = new_id('session')
+    session = {
+        'id': session_id,
+        'profile_id': profile_id,
+        'topic': topic,
+        'questions': questions,
+        'current_question': 0,
+        'score': 0,
+        'answers': []
+    }
+    if generating:
+        # Questions are still streaming in; submit_answer waits on this flag
+        session['generating'] = True
+    with session_create_seconds.time():
+        store.add_session(session)
+    return session
+
+def process_memory_bytes():
+    """Resident memory of this process, or its peak where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return None
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_model_questions(topic, age, flight):
+    """Stream questions from the model, publishing each one to ``flight``.
+
+    Runs in the request that leads a cold stream; the flight is finished
+    with ``(complete, failure)`` so requests following it know how it ended.
+    """
+    parser = QuestionStreamParser()
+    count = 0
+    complete = False
+    failure = 'no_model'
+    try:
+        if model is None:
+            return
+        failure = 'bad_structure'
+        started = time.perf_counter()
+        chunk = None
+        try:
+            for chunk in call_model(build_quiz_prompt(topic, age), stream=True):
+                for question in parser.feed(chunk.text or ''):
+                    if not count:
+                        stream_first_question_seconds.observe(time.perf_counter() - started)
+                    count += 1
+                    flight.publish(question)
+                    yield question
+            if chunk is not None:
+                # The last chunk carries the usage for the whole stream
+                record_token_usage(chunk, 'stream')
+            complete = parser.done and count >= QUIZ_QUESTION_COUNT
+        except GeneratorExit:
+            failure = 'abandoned'
+            raise
+        except Exception as api_error:
+            failure = failure_reason(api_error)
+            logger.error(f"Gemini streaming error: {api_error}")
+    finally:
+        flight.finish((complete, failure))
+
+def stream_quiz_questions(session, topic, age):
+    """Generate a quiz with a streaming model call, yielding SSE events.
+
+    Each question is appended to the session as soon as it is parsed, so the
+    first one can be answered while the rest are still being generated.
+    Identical cold streams share one model call: the first request leads it
+    and the others replay its questions as they arrive.
+    """
+    session_id = session['id']
+    yield sse_event('session', {'session_id': session_id, 'topic': topic})
+
+    key = cache_key(topic, age)
+    questions = []
+    finished = False
+    complete = False
+    leader = False
+    try:
+        try:
+            with quiz_inflight.stream(key) as (flight, leader):
+                if leader:
+                    produce = stream_model_questions(topic, age, flight)
+                else:
+                    produce = flight.follow(QUIZ_INFLIGHT_TIMEOUT)
+                try:
+                    for question in produce:
+                        questions.append(question)
+                        store.append_question(session_id, question)
+                        yield sse_event('question', {'index': len(questions) - 1, 'question': question})
+                    complete, failure = flight.result or (False, 'abandoned')
+                except TimeoutError:
+                    logger.warning(f"Timed out following the in-flight stream for session {session_id}")
+                    failure = 'inflight_timeout'
+                finally:
+                    produce.close()
+        except WaitersFull:
+            failure = 'inflight_full'
+
+        if questions:
+            store.finish_generation(session_id)
+            finished = True
+            if complete:
+                source = 'model'
+                if leader:
+                    quiz_cache.put(key, {'questions': questions})
+            else:
+                # Already sent and maybe answered, so keep them, but a cut
+                # short quiz must not be served to anyone else
+                logger.warning(f"Stream for session {session_id} ended after {len(questions)} questions, not caching")
+                source = 'partial'
+        else:
+            logger.warning(f"No questions streamed for session {session_id}, using mock data")
+            quiz_fallbacks.inc(reason=failure)
+            source = 'mock'
+            questions = build_mock_quiz(topic)['questions']
+            store.finish_generation(session_id, questions)
+            finished = True
+            for index, question in enumerate(questions):
+                yield sse_event('question', {'index': index, 'question': question})
+
+        yield sse_event('done', {'session_id': session_id, 'total_questions': len(questions), 'source': source})
+    finally:
+        # Also reached when the client disconnects mid-stream
+        if not finished:
+            store.finish_generation(session_id, build_mock_quiz(topic)['questions'])
+        logger.info(f"Streamed quiz for topic: {topic}, session: {session_id}, questions: {len(questions)}")
+
+prefill_quiz_pool()
+
+# Scrape-time views of state the components already track
+metrics.gauge('quiz_sessions', 'Live quiz sessions in the store', callback=lambda: store.count_sessions())
+metrics.gauge('quiz_profiles', 'Profiles in the store', callback=lambda: store.count_profiles())
+metrics.gauge('quiz_cache_entries', 'Quizzes held in the quiz cache', callback=lambda: quiz_cache.stats()['size'])
+metrics.callback_counter('quiz_cache_lookups_total', 'Quiz cache lookups by result', ('result',),
+                         callback=lambda: {'hit': quiz_cache.stats()['hits'], 'miss': quiz_cache.stats()['misses']})
+metrics.gauge('quiz_inflight_generations', 'Distinct quiz generations in flight', callback=lambda: quiz_inflight.stats()['in_flight'])
+metrics.gauge('quiz_pool_depth', 'Ready quizzes in the warm pool', callback=lambda: quiz_pool.stats()['depth'])
+metrics.gauge('quiz_upstream_in_flight', 'Gemini calls holding an upstream slot', callback=lambda: upstream.stats()['in_flight'])
+metrics.callback_counter('quiz_upstream_rejections_total', 'Gemini calls refused or abandoned by the upstream gate', ('reason',),
+                         callback=lambda: {'saturated': upstream.stats()['saturated'], 'timeout': upstream.stats()['timeouts']})
+metrics.gauge('process_resident_memory_bytes', 'Resident memory of this worker process', callback=process_memory_bytes)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profiler = None
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler; another request has it
+            return
+        g.profiler = profiler
+
+@app.after_request
+def record_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    method = request.method
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    profiler = g.get('profiler')
+
+    def finish():
+        # Runs once the body has been sent, so streamed quizzes are timed in full
+        elapsed = time.perf_counter() - started
+        http_request_seconds.observe(elapsed, method=method, route=route, status=response.status_code)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed * 1000 >= PROFILE_SLOW_MS:
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                logger.warning(f"Slow request {method} {route} took {elapsed * 1000:.0f}ms:\n{out.getvalue()}")
+
+    response.call_on_close(finish)
+    return response
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    # Also covers requests that never reach after_request
+    profiler = g.get('profiler')
+    if profiler is not None:
+        profiler.disable()
 
 @app.route('/')
 def serve_frontend():
@@ -42,7 +658,7 @@ def serve_assets(path):
 def create_profile():
     try:
         data = request.get_json()
-        profile_id = f"profile_{len(profiles) + 1}"
+        profile_id = new_id('profile')
         
         profile = {
             'id': profile_id,
@@ -51,8 +667,10 @@ def create_profile():
             'interests': data.get('interests', [])
         }
         
-        profiles[profile_id] = profile
+        store.add_profile(profile)
         logger.info(f"Created profile: {profile}")
+
+        warm_quiz_pool(profile['interests'], profile['age'], limit=QUIZ_POOL_INTERESTS_PER_PROFILE)
         
         return jsonify({
             'success': True,
@@ -69,136 +687,28 @@ def generate_quiz():
         topic = data.get('topic', '')
         profile_id = data.get('profile_id', '')
         
-        if not profile_id or profile_id not in profiles:
+        profile = store.get_profile(profile_id) if profile_id else None
+        if profile is None:
             return jsonify({'success': False, 'error': 'Invalid profile'}), 400
         
-        profile = profiles[profile_id]
         age = profile['age']
         
-        if model and GEMINI_API_KEY:
-            try:
-                # Generate quiz using Gemini API with enhanced prompts
-                prompt = f"""
-                You are Quizzy, a friendly and enthusiastic AI teacher who loves helping children learn!
-                Create an amazing, fun quiz about "{topic}" for a {age}-year-old child.
-
-                IMPORTANT REQUIREMENTS:
-                - Generate exactly 4 multiple choice questions
-                - Each question should have 4 options (A, B, C, D)
-                - Use simple, clear language perfect for a {age}-year-old
-                - Make questions engaging with "Did you know..." or "Can you guess..." style
-                - Include fun facts and surprising information
-                - Use emojis and exciting language where appropriate
-                - Make explanations encouraging and educational
-                - Avoid scary, negative, or complex topics
-                - Focus on wonder, discovery, and positive learning
-
-                CONTENT GUIDELINES:
-                - Questions should spark curiosity and imagination
-                - Include relatable examples from a child's world
-                - Make learning feel like an adventure
-                - Use positive, encouraging tone throughout
-                - Explanations should teach something new and exciting
-
-                Return the response in this exact JSON format:
-                {{
-                    "questions": [
-                        {{
-                            "question": "Exciting question that makes kids curious?",
-                            "options": ["Fun first option", "Amazing second option", "Cool third option", "Awesome fourth option"],
-                            "correct_answer": 0,
-                            "explanation": "Wow! That's right! Here's why this is so amazing and what makes it special for kids to understand..."
-                        }}
-                    ]
-                }}
-                """
-                
-                response = model.generate_content(prompt)
-                logger.info(f"Gemini API response: {response.text}")
-                
-                # Check if response is empty or None
-                if not response.text or response.text.strip() == "":
-                    logger.warning("Empty response from Gemini API, using mock data")
-                    raise ValueError("Empty response from API")
-                
-                # Try to parse JSON, with fallback handling
-                try:
-                    quiz_data = json.loads(response.text)
-                except json.JSONDecodeError as json_error:
-                    logger.error(f"JSON parsing error: {json_error}")
-                    logger.error(f"Raw response text: {repr(response.text)}")
-                    
-                    # Try to extract JSON from response if it contains other text
-                    json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
-                    if json_match:
-                        try:
-                            quiz_data = json.loads(json_match.group())
-                            logger.info("Successfully extracted JSON from response")
-                        except json.JSONDecodeError:
-                            logger.error("Failed to extract valid JSON, using mock data")
-                            raise ValueError("Invalid JSON in API response")
-                    else:
-                        logger.error("No JSON found in response, using mock data")
-                        raise ValueError("No JSON found in API response")
-                
-                # Validate the structure of quiz_data
-                if not isinstance(quiz_data, dict) or 'questions' not in quiz_data:
-                    logger.error("Invalid quiz data structure, using mock data")
-                    raise ValueError("Invalid quiz data structure")
-                    
-                if not isinstance(quiz_data['questions'], list) or len(quiz_data['questions']) == 0:
-                    logger.error("No questions in quiz data, using mock data")
-                    raise ValueError("No questions in quiz data")
-                        
-            except Exception as api_error:
-                logger.error(f"Gemini API error: {api_error}, falling back to mock data")
-                # Fall through to mock response
-                quiz_data = None
-        else:
-            quiz_data = None
-            
+        try:
+            quiz_data, failure = get_or_generate_quiz(topic, age)
+        except UpstreamSaturated:
+            logger.warning(f"Gemini is saturated, not generating quiz for topic: {topic}")
+            if UPSTREAM_SATURATED_RESPONSE == '503':
+                return jsonify({'success': False, 'error': 'Quiz generator is busy, please try again'}), 503, {'Retry-After': '2'}
+            quiz_data, failure = None, 'saturated'
+
         # Use enhanced mock response if API is not available or failed
         if quiz_data is None:
-            quiz_data = {
-                "questions": [
-                    {
-                        "question": f"🌟 Did you know that {topic} can be super exciting? What makes {topic} so amazing?",
-                        "options": ["It's full of surprises! ✨", "It helps us learn cool things! 🧠", "It's fun to explore! 🔍", "All of these awesome things! 🎉"],
-                        "correct_answer": 3,
-                        "explanation": f"Wow! You're absolutely right! {topic} is full of surprises, helps us learn amazing things, and is so much fun to explore! You're such a smart learner! 🌟"
-                    },
-                    {
-                        "question": f"🤔 If you could tell your best friend about {topic}, what would you say?",
-                        "options": ["It's boring 😴", "It's the most exciting thing ever! 🚀", "It's too hard to understand 😕", "I don't care about it 🤷"],
-                        "correct_answer": 1,
-                        "explanation": f"Yes! {topic} really IS the most exciting thing ever! There's so much to discover and learn. Your enthusiasm for learning is fantastic! 🎊"
-                    },
-                    {
-                        "question": f"🎯 What's the most fun way to learn about {topic}?",
-                        "options": ["Reading colorful books 📚", "Watching awesome videos 📺", "Asking lots of questions ❓", "Doing all of these amazing things! 🌈"],
-                        "correct_answer": 3,
-                        "explanation": "Outstanding choice! The best learners use ALL these ways - books, videos, and asking questions! You're becoming a learning superhero! 🦸‍♀️🦸‍♂️"
-                    },
-                    {
-                        "question": f"💫 Why do you think learning about {topic} is important for kids like you?",
-                        "options": ["It helps us understand our amazing world 🌍", "It's super fun and exciting 🎈", "It makes us smarter and more curious 🧠", "All of these incredible reasons! ⭐"],
-                        "correct_answer": 3,
-                        "explanation": f"Perfect! Learning about {topic} does ALL these wonderful things! It helps you understand the world, brings joy and excitement, and makes you smarter and more curious every day! Keep being awesome! 🏆"
-                    }
-                ]
-            }
-        
+            quiz_fallbacks.inc(reason=failure)
+            quiz_data = build_mock_quiz(topic)
+
         # Create quiz session
-        session_id = f"session_{len(quiz_sessions) + 1}"
-        quiz_sessions[session_id] = {
-            'id': session_id,
-            'profile_id': profile_id,
-            'topic': topic,
-            'questions': quiz_data['questions'],
-            'current_question': 0,
-            'score': 0,
-            'answers': []
-        }
+        session = create_quiz_session(profile_id, topic, quiz_data['questions'])
+        session_id = session['id']
         
         logger.info(f"Generated quiz for topic: {topic}, profile: {profile_id}")
         
@@ -212,6 +722,134 @@ def generate_quiz():
         logger.error(f"Error generating quiz: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/quiz/generate/stream', methods=['POST'])
+def generate_quiz_stream():
+    try:
+        data = request.get_json()
+        topic = data.get('topic', '')
+        profile_id = data.get('profile_id', '')
+
+        profile = store.get_profile(profile_id) if profile_id else None
+        if profile is None:
+            return jsonify({'success': False, 'error': 'Invalid profile'}), 400
+
+        age = profile['age']
+
+        cached, source = get_ready_quiz(topic, age)
+        if cached is not None:
+            session = create_quiz_session(profile_id, topic, cached['questions'])
+
+            def replay():
+                yield sse_event('session', {'session_id': session['id'], 'topic': topic})
+                for index, question in enumerate(cached['questions']):
+                    yield sse_event('question', {'index': index, 'question': question})
+                yield sse_event('done', {'session_id': session['id'], 'total_questions': len(cached['questions']), 'source': source})
+
+            events = replay()
+        else:
+            session = create_quiz_session(profile_id, topic, [], generating=True)
+            events = stream_quiz_questions(session, topic, age)
+
+        return Response(
+            stream_with_context(events),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    except Exception as e:
+        logger.error(f"Error streaming quiz: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/quiz/generate/batch', methods=['POST'])
+def generate_quiz_batch():
+    try:
+        data = request.get_json()
+        items = data.get('items', [])
+
+        if not isinstance(items, list) or len(items) == 0:
+            return jsonify({'success': False, 'error': 'No items to generate'}), 400
+        if len(items) > QUIZ_BATCH_MAX_ITEMS:
+            return jsonify({'success': False, 'error': f'At most {QUIZ_BATCH_MAX_ITEMS} items per batch'}), 400
+
+        results = [None] * len(items)
+        requested = []
+        quizzes = {}
+        # Cold topics grouped by age band: band -> (age, {normalized topic: topic})
+        cold = {}
+
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            profile_id = item.get('profile_id', '')
+            topic = item.get('topic', '')
+
+            profile = store.get_profile(profile_id) if profile_id and isinstance(profile_id, str) else None
+            if profile is None:
+                results[index] = {'profile_id': profile_id, 'topic': topic, 'success': False, 'error': 'Invalid profile'}
+                continue
+            if not isinstance(topic, str):
+                results[index] = {'profile_id': profile_id, 'topic': topic, 'success': False, 'error': 'Invalid topic'}
+                continue
+
+            key = cache_key(topic, profile['age'])
+            requested.append((index, profile_id, topic, key))
+            if key in quizzes:
+                continue
+
+            quiz_data, source = get_ready_quiz(topic, profile['age'])
+            quizzes[key] = (quiz_data, source)
+            if quiz_data is None:
+                age, topics = cold.setdefault(key[1], (profile['age'], {}))
+                topics.setdefault(key[0], topic)
+
+        # Every prompt is in flight at once, so the batch waits for the
+        # slowest model call rather than the sum of them
+        chunks = []
+        for band, (age, topics) in cold.items():
+            topics = list(topics.values())
+            for start in range(0, len(topics), QUIZ_BATCH_TOPICS_PER_PROMPT):
+                chunk = topics[start:start + QUIZ_BATCH_TOPICS_PER_PROMPT]
+                chunks.append((band, chunk, batch_executor.submit(generate_quizzes_with_model, chunk, age)))
+
+        # Why each key that got no quiz falls back to the mock one
+        failures = {}
+        for band, chunk, future in chunks:
+            generated, reason = future.result()
+            for topic_key, quiz_data in generated.items():
+                key = (topic_key, band)
+                if key in quizzes:
+                    quiz_cache.put(key, quiz_data)
+                    quizzes[key] = (quiz_data, 'model')
+            for topic in chunk:
+                failures.setdefault((normalize_topic(topic), band), reason)
+        model_calls = len(chunks)
+
+        for index, profile_id, topic, key in requested:
+            quiz_data, source = quizzes[key]
+            if quiz_data is None:
+                quiz_fallbacks.inc(reason=failures.get(key, 'api_error'))
+                quiz_data, source = build_mock_quiz(topic), 'mock'
+
+            session = create_quiz_session(profile_id, topic, quiz_data['questions'])
+            results[index] = {
+                'profile_id': profile_id,
+                'topic': topic,
+                'success': True,
+                'session_id': session['id'],
+                'source': source,
+                'quiz': quiz_data
+            }
+
+        logger.info(f"Generated batch of {len(items)} quizzes with {model_calls} model calls")
+
+        return jsonify({
+            'success': True,
+            'results': results
+        })
+
+    except Exception as e:
+        logger.error(f"Error generating quiz batch: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/quiz/answer', methods=['POST'])
 def submit_answer():
     try:
@@ -219,40 +857,27 @@ def submit_answer():
         session_id = data.get('session_id', '')
         answer_index = data.get('answer_index', -1)
         
-        if session_id not in quiz_sessions:
+        try:
+            result = store.record_answer(session_id, answer_index)
+        except SessionNotFound:
             return jsonify({'success': False, 'error': 'Invalid session'}), 400
-        
-        session = quiz_sessions[session_id]
-        current_q = session['current_question']
-        
-        if current_q >= len(session['questions']):
+        except QuestionNotReady:
+            return jsonify({'success': False, 'error': 'Question not ready yet', 'pending': True}), 409
+        except QuizCompleted:
             return jsonify({'success': False, 'error': 'Quiz completed'}), 400
-        
-        question = session['questions'][current_q]
-        is_correct = answer_index == question['correct_answer']
-        
-        if is_correct:
-            session['score'] += 1
-        
-        session['answers'].append({
-            'question_index': current_q,
-            'answer_index': answer_index,
-            'is_correct': is_correct
-        })
-        
-        session['current_question'] += 1
-        
+
+        is_correct = result['is_correct']
         response_data = {
             'success': True,
             'is_correct': is_correct,
-            'explanation': question['explanation'],
-            'current_score': session['score'],
-            'is_quiz_complete': session['current_question'] >= len(session['questions'])
+            'explanation': result['explanation'],
+            'current_score': result['score'],
+            'is_quiz_complete': result['is_quiz_complete']
         }
         
         if response_data['is_quiz_complete']:
-            response_data['final_score'] = session['score']
-            response_data['total_questions'] = len(session['questions'])
+            response_data['final_score'] = result['score']
+            response_data['total_questions'] = result['total_questions']
         
         logger.info(f"Answer submitted for session {session_id}: {'Correct' if is_correct else 'Incorrect'}")
         
@@ -265,10 +890,10 @@ def submit_answer():
 @app.route('/api/quiz/session/<session_id>')
 def get_quiz_session(session_id):
     try:
-        if session_id not in quiz_sessions:
+        session = store.get_session(session_id)
+        if session is None:
             return jsonify({'success': False, 'error': 'Session not found'}), 404
         
-        session = quiz_sessions[session_id]
         return jsonify({
             'success': True,
             'session': session
@@ -277,6 +902,22 @@ def get_quiz_session(session_id):
         logger.error(f"Error getting session: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/stats')
+def get_stats():
+    return jsonify({
+        'success': True,
+        'cache': quiz_cache.stats(),
+        'inflight': quiz_inflight.stats(),
+        'pool': quiz_pool.stats(),
+        'upstream': upstream.stats(),
+        'storage': store.stats(),
+        'memory_bytes': process_memory_bytes()
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') != 'production'
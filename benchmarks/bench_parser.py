@@ -0,0 +1,182 @@
+"""Benchmark quiz response parsing against a corpus of recorded model replies.
+
+Compares the original json.loads + greedy regex approach with
+quiz_parser.parse_quiz_response on every response in responses.json, plus a
+synthetic long reply full of prose braces.
+
+    python benchmarks/bench_parser.py
+    python benchmarks/bench_parser.py --iterations 2000 --json results.json
+    python benchmarks/bench_parser.py --json - > results.json   # table goes to stderr
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quiz_parser import QuizParseError, parse_quiz_response  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'responses.json')
+
+
+def legacy_parse(text):
+    """The parsing generate_quiz did before quiz_parser existed."""
+    if not text or text.strip() == "":
+        raise ValueError("Empty response from API")
+    try:
+        quiz_data = json.loads(text)
+    except json.JSONDecodeError:
+        json_match = re.search(r'\{.*\}', text, re.DOTALL)
+        if not json_match:
+            raise ValueError("No JSON found in API response")
+        try:
+            quiz_data = json.loads(json_match.group())
+        except json.JSONDecodeError:
+            raise ValueError("Invalid JSON in API response")
+    if not isinstance(quiz_data, dict) or 'questions' not in quiz_data:
+        raise ValueError("Invalid quiz data structure")
+    if not isinstance(quiz_data['questions'], list) or len(quiz_data['questions']) == 0:
+        raise ValueError("No questions in quiz data")
+    return quiz_data
+
+
+def would_break_submit(quiz_data):
+    """True if submit_answer would hit a question it can't grade."""
+    for question in quiz_data['questions']:
+        try:
+            options = question['options']
+            correct = question['correct_answer']
+            question['explanation']
+        except (TypeError, KeyError):
+            return True
+        if not isinstance(correct, int) or isinstance(correct, bool) or not 0 <= correct < len(options):
+            return True
+    return False
+
+
+def run_legacy(text):
+    try:
+        quiz_data = legacy_parse(text)
+    except ValueError:
+        return 'fail', 0
+    if would_break_submit(quiz_data):
+        return 'broken', len(quiz_data['questions'])
+    return 'ok', len(quiz_data['questions'])
+
+
+def run_parser(text):
+    try:
+        quiz_data, dropped = parse_quiz_response(text)
+    except QuizParseError:
+        return 'fail', 0
+    return ('salvaged' if dropped else 'ok'), len(quiz_data['questions'])
+
+
+def parser_answers(text):
+    """The option text each parsed question marks as correct."""
+    try:
+        quiz_data, _ = parse_quiz_response(text)
+    except QuizParseError:
+        return []
+    return [question['options'][question['correct_answer']] for question in quiz_data['questions']]
+
+
+def synthetic_cases():
+    question = {
+        "question": "How many legs does a spider have?",
+        "options": ["6", "8", "10", "4"],
+        "correct_answer": 1,
+        "explanation": "Spiders have 8 legs!"
+    }
+    quiz = json.dumps({"questions": [question] * 4})
+    prose = "Remember {curly braces} are fun! " * 2000
+    return [
+        {"name": "long_prose_braces_after", "expect": "ok", "text": quiz + "\n" + prose},
+        {"name": "long_prose_braces_before", "expect": "ok", "text": prose + "\n" + quiz},
+    ]
+
+
+def time_call(fn, text, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(text)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--json', metavar='PATH', help='also write results as JSON to PATH ("-" for stdout)')
+    args = parser.parse_args()
+
+    with open(CORPUS, encoding='utf-8') as f:
+        cases = json.load(f) + synthetic_cases()
+
+    rows = []
+    for case in cases:
+        text = case['text']
+        legacy_outcome, legacy_questions = run_legacy(text)
+        parser_outcome, parser_questions = run_parser(text)
+        rows.append({
+            'name': case['name'],
+            'expect': case['expect'],
+            'answers_ok': 'answers' not in case or parser_answers(text) == case['answers'],
+            'bytes': len(text.encode('utf-8')),
+            'legacy': {
+                'outcome': legacy_outcome,
+                'questions': legacy_questions,
+                'us_per_call': round(time_call(run_legacy, text, args.iterations), 2)
+            },
+            'parser': {
+                'outcome': parser_outcome,
+                'questions': parser_questions,
+                'us_per_call': round(time_call(run_parser, text, args.iterations), 2)
+            }
+        })
+
+    def summary(side):
+        outcomes = [row[side]['outcome'] for row in rows]
+        return {
+            'ok': outcomes.count('ok'),
+            'salvaged': outcomes.count('salvaged'),
+            'broken': outcomes.count('broken'),
+            'fail': outcomes.count('fail'),
+            'total_us': round(sum(row[side]['us_per_call'] for row in rows), 2)
+        }
+
+    results = {
+        'iterations': args.iterations,
+        'cases': rows,
+        'summary': {'legacy': summary('legacy'), 'parser': summary('parser')},
+        'mismatches': [
+            row['name'] for row in rows
+            if row['parser']['outcome'] != row['expect'] or not row['answers_ok']
+        ]
+    }
+
+    # Keep stdout clean for the JSON when it goes there
+    report = sys.stderr if args.json == '-' else sys.stdout
+    print(f"{'case':<28} {'bytes':>7}  {'legacy':>18}  {'parser':>18}", file=report)
+    for row in rows:
+        legacy = f"{row['legacy']['outcome']} {row['legacy']['us_per_call']:.1f}us"
+        parsed = f"{row['parser']['outcome']} {row['parser']['us_per_call']:.1f}us"
+        print(f"{row['name']:<28} {row['bytes']:>7}  {legacy:>18}  {parsed:>18}", file=report)
+    for side in ('legacy', 'parser'):
+        print(f"{side}: {results['summary'][side]}", file=report)
+    if results['mismatches']:
+        print(f"parser outcome differs from expected for: {', '.join(results['mismatches'])}", file=report)
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if results['mismatches'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""A stand-in for genai.GenerativeModel for offline benchmarks.
+
+It answers quiz prompts (single and batch) with well-formed quizzes after a
+configurable delay, and can be told to fail or return malformed output at a
+given rate. Assign an instance to ``app.model`` to use it.
+"""
+import json
+import random
+import re
+import threading
+import time
+
+BATCH_TOPIC = re.compile(r'^\s*\d+\. "(.*)"\s*$', re.MULTILINE)
+SINGLE_TOPIC = re.compile(r'quiz about "(.*)" for a')
+
+MALFORMED_REPLIES = (
+    "",
+    "I'm sorry, I can't make a quiz about that right now!",
+    '{"questions": [{"question": "Cut off half way',
+    '{"questions": []}',
+    '{"questions": [{"question": "Broken?", "options": ["a"], "correct_answer": 3}]}',
+)
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Deterministic-per-seed fake of the Gemini model used by app.py.
+
+    ``latency`` and ``jitter`` are in seconds; ``failure_rate`` raises an
+    exception and ``malformed_rate`` returns unusable text, each as a
+    probability per call.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.1, failure_rate=0.0, malformed_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            outcome = self._random.random()
+            malformed = self._random.choice(MALFORMED_REPLIES)
+        if outcome < self.failure_rate:
+            return delay, 'fail', malformed
+        if outcome < self.failure_rate + self.malformed_rate:
+            return delay, 'malformed', malformed
+        return delay, 'ok', malformed
+
+    @staticmethod
+    def _quiz(topic):
+        return {
+            'topic': topic,
+            'questions': [
+                {
+                    'question': f"Can you guess fact {i + 1} about {topic}? 🤔",
+                    'options': [f"{topic} answer {letter}" for letter in 'ABCD'],
+                    'correct_answer': i % 4,
+                    'explanation': f"Wow! That's fact {i + 1} about {topic}! 🌟"
+                }
+                for i in range(4)
+            ]
+        }
+
+    def _reply(self, prompt):
+        batch_topics = BATCH_TOPIC.findall(prompt)
+        if '"quizzes"' in prompt and batch_topics:
+            return json.dumps({'quizzes': [self._quiz(topic) for topic in batch_topics]}, ensure_ascii=False)
+        match = SINGLE_TOPIC.search(prompt)
+        quiz = self._quiz(match.group(1) if match else 'fun things')
+        return json.dumps({'questions': quiz['questions']}, ensure_ascii=False)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        delay, outcome, malformed = self._roll()
+        text = malformed if outcome == 'malformed' else self._reply(prompt)
+
+        if not stream:
+            time.sleep(delay)
+            if outcome == 'fail':
+                raise RuntimeError("Fake upstream error")
+            return FakeResponse(text)
+
+        def chunks(size=64):
+            # Spread the delay over the stream like real token output
+            pieces = [text[i:i + size] for i in range(0, len(text), size)] or ['']
+            for piece in pieces:
+                time.sleep(delay / len(pieces))
+                if outcome == 'fail':
+                    raise RuntimeError("Fake upstream error")
+                yield FakeResponse(piece)
+
+        return chunks()
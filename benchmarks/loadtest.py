@@ -0,0 +1,308 @@
+"""Load test the quiz API end to end against a fake Gemini backend.
+
+Each virtual user creates a profile, generates a quiz, answers every
+question and fetches the session, like the frontend does. The app runs
+in-process on a local threaded server with benchmarks.fake_gemini standing in
+for the model, so this works offline. Reports req/s and p50/p95/p99 latency
+per endpoint at each concurrency level.
+
+Every level starts cold: the quiz cache, in-flight generations, warm pool and
+store are reset first, so levels are comparable and cache regressions show up
+in the model call counts. Pass --warm to carry them over instead.
+
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --concurrency 1,16,64 --users 200 --latency 0.8 --json results.json
+    python benchmarks/loadtest.py --json - > results.json   # tables go to stderr
+    python benchmarks/loadtest.py --url http://localhost:5000   # an already running server
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOPICS = (
+    'dinosaurs', 'space', 'oceans', 'volcanoes', 'butterflies', 'robots', 'rainforests',
+    'planets', 'sharks', 'music', 'the human body', 'ancient egypt', 'weather', 'insects',
+    'trains', 'castles'
+)
+
+
+def start_local_server(args):
+    """Import app.py with the fake model swapped in and serve it on a free port."""
+    # Settings app.py reads at import time
+    os.environ.setdefault('QUIZ_POOL_ENABLED', 'true' if args.pool else 'false')
+    os.environ.setdefault('STORAGE_BACKEND', args.storage)
+    if args.storage == 'sqlite':
+        # Levels delete this database, so never pick up the app's own path
+        os.environ['SQLITE_PATH'] = args.sqlite_path
+
+    from werkzeug.serving import make_server
+
+    import app as quiz_app
+    from benchmarks.fake_gemini import FakeGenerativeModel
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    quiz_app.model = FakeGenerativeModel(
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed
+    )
+    server = make_server('127.0.0.1', 0, quiz_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}", quiz_app
+
+
+def reset_app(quiz_app, args):
+    """Drop every cached, pooled and stored quiz so the next level starts cold."""
+    from quiz_cache import SingleFlight
+    from storage import create_store
+
+    quiz_app.quiz_cache.clear()
+    quiz_app.quiz_inflight = SingleFlight()
+    quiz_app.quiz_pool.clear()
+    limits = quiz_app.store.limits
+    if args.storage == 'sqlite':
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(args.sqlite_path + suffix)
+            except FileNotFoundError:
+                pass
+    quiz_app.store = create_store(args.storage, sqlite_path=args.sqlite_path, limits=limits)
+    if args.pool:
+        # The pool only prefills at import when a real model is configured
+        quiz_app.prefill_quiz_pool()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def request_json(base_url, method, path, body=None, timeout=60):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method)
+    req.add_header('Content-Type', 'application/json')
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            raw = resp.read()
+            status = resp.status
+            content_type = resp.headers.get('Content-Type', '')
+    except urllib.error.HTTPError as e:
+        raw = e.read()
+        status = e.code
+        content_type = e.headers.get('Content-Type', '')
+    if content_type.startswith('text/event-stream'):
+        return status, raw.decode('utf-8')
+    return status, json.loads(raw) if raw else {}
+
+
+def timed(recorder, endpoint, base_url, method, path, body=None):
+    started = time.perf_counter()
+    try:
+        status, payload = request_json(base_url, method, path, body)
+        ok = status < 400
+    except Exception:
+        status, payload, ok = 0, {}, False
+    recorder.record(endpoint, time.perf_counter() - started, ok)
+    return status, payload
+
+
+def session_from_stream(text):
+    for line in text.splitlines():
+        if line.startswith('data: ') and '"session_id"' in line:
+            return json.loads(line[len('data: '):])['session_id']
+    return None
+
+
+def run_user(base_url, recorder, rng, topics, stream):
+    _, payload = timed(recorder, 'POST /api/profile', base_url, 'POST', '/api/profile', {
+        'name': 'Load Test',
+        'age': rng.randint(5, 12),
+        'interests': []
+    })
+    profile_id = (payload.get('profile') or {}).get('id') if isinstance(payload, dict) else None
+    if not profile_id:
+        return
+
+    topic = rng.choice(topics)
+    if stream:
+        _, payload = timed(recorder, 'POST /api/quiz/generate/stream', base_url, 'POST',
+                           '/api/quiz/generate/stream', {'topic': topic, 'profile_id': profile_id})
+        session_id = session_from_stream(payload) if isinstance(payload, str) else None
+    else:
+        _, payload = timed(recorder, 'POST /api/quiz/generate', base_url, 'POST',
+                           '/api/quiz/generate', {'topic': topic, 'profile_id': profile_id})
+        session_id = payload.get('session_id') if isinstance(payload, dict) else None
+    if not session_id:
+        return
+
+    for _ in range(10):
+        _, payload = timed(recorder, 'POST /api/quiz/answer', base_url, 'POST', '/api/quiz/answer', {
+            'session_id': session_id,
+            'answer_index': rng.randint(0, 3)
+        })
+        if not isinstance(payload, dict) or not payload.get('success') or payload.get('is_quiz_complete'):
+            break
+
+    timed(recorder, 'GET /api/quiz/session', base_url, 'GET', f'/api/quiz/session/{session_id}')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile: the smallest value with pct% of samples at or below it."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def run_level(base_url, concurrency, users, topics, stream, seed):
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(run_user, base_url, recorder, random.Random(seed * 100003 + i), topics, stream)
+            for i in range(users)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for endpoint, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        endpoints[endpoint] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(endpoint, 0),
+            'rps': round(len(samples) / elapsed, 2),
+            'p50_ms': round(percentile(samples, 50) * 1000, 2),
+            'p95_ms': round(percentile(samples, 95) * 1000, 2),
+            'p99_ms': round(percentile(samples, 99) * 1000, 2),
+            'max_ms': round(samples[-1] * 1000, 2)
+        }
+    total = sum(e['requests'] for e in endpoints.values())
+    errors = sum(e['errors'] for e in endpoints.values())
+    return {
+        'concurrency': concurrency,
+        'users': users,
+        'seconds': round(elapsed, 3),
+        'requests': total,
+        'errors': errors,
+        'rps': round(total / elapsed, 2) if elapsed else 0.0,
+        'endpoints': endpoints
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='test this running server instead of starting one (the fake model is not used)')
+    parser.add_argument('--concurrency', default='1,8,32', help='comma separated concurrency levels')
+    parser.add_argument('--users', type=int, default=50, help='virtual users per concurrency level')
+    parser.add_argument('--topics', type=int, default=8, help='distinct topics users pick from')
+    parser.add_argument('--stream', action='store_true', help='use /api/quiz/generate/stream')
+    parser.add_argument('--latency', type=float, default=0.5, help='fake model latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.1, help='+/- seconds added to the latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of model calls that raise')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='fraction of model calls returning unusable text')
+    parser.add_argument('--pool', action='store_true', help='keep the warm quiz pool enabled')
+    parser.add_argument('--warm', action='store_true',
+                        help='keep the cache, pool and store from one level to the next instead of resetting them')
+    parser.add_argument('--storage', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--sqlite-path', default='loadtest.db')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-error-rate', type=float, default=None,
+                        help='exit non-zero if any level exceeds this error fraction')
+    parser.add_argument('--json', metavar='PATH', help='also write results as JSON to PATH ("-" for stdout)')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    topics = list(TOPICS[:max(1, min(args.topics, len(TOPICS)))])
+
+    server = quiz_app = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        server, base_url, quiz_app = start_local_server(args)
+
+    results = {
+        'config': {
+            'url': args.url,
+            'users': args.users,
+            'topics': len(topics),
+            'stream': args.stream,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'failure_rate': args.failure_rate,
+            'malformed_rate': args.malformed_rate,
+            'pool': args.pool,
+            'warm': args.warm,
+            'storage': args.storage
+        },
+        'levels': []
+    }
+
+    # Keep stdout clean for the JSON when it goes there
+    report = sys.stderr if args.json == '-' else sys.stdout
+
+    try:
+        for index, concurrency in enumerate(levels):
+            if quiz_app is not None and (index == 0 or not args.warm):
+                reset_app(quiz_app, args)
+            calls_before = quiz_app.model.calls if quiz_app is not None else 0
+            level = run_level(base_url, concurrency, args.users, topics, args.stream, args.seed)
+            if quiz_app is not None:
+                level['model_calls'] = quiz_app.model.calls - calls_before
+            results['levels'].append(level)
+
+            model_calls = f", {level['model_calls']} model calls" if 'model_calls' in level else ''
+            print(f"\nconcurrency={concurrency} users={args.users} "
+                  f"{level['requests']} requests in {level['seconds']}s ({level['rps']} req/s, {level['errors']} errors{model_calls})",
+                  file=report)
+            print(f"  {'endpoint':<32} {'reqs':>6} {'err':>4} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}", file=report)
+            for endpoint, stats in level['endpoints'].items():
+                print(f"  {endpoint:<32} {stats['requests']:>6} {stats['errors']:>4} {stats['rps']:>8} "
+                      f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}", file=report)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    if quiz_app is not None:
+        results['model_calls'] = quiz_app.model.calls
+        print(f"\nfake model calls: {quiz_app.model.calls}", file=report)
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_error_rate is not None:
+        for level in results['levels']:
+            if level['requests'] and level['errors'] / level['requests'] > args.max_error_rate:
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,25 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Threaded workers: a request waiting on Gemini holds one thread, not a whole
+# process. In app.py the upstream gate caps the threads calling the model
+# (GEMINI_MAX_CONCURRENT) and single-flight caps the threads waiting on
+# someone else's call (QUIZ_INFLIGHT_MAX_WAITERS); keep their sum well below
+# GUNICORN_THREADS so cheap endpoints like /api/quiz/answer always have
+# threads left. Use STORAGE_BACKEND=sqlite with more than one worker so all
+# of them share sessions.
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+# Longer than GEMINI_TIMEOUT so slow model calls fall back before the worker
+# is killed; streaming responses also need room to finish.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
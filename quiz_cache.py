@@ -0,0 +1,316 @@
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Phrases the voice input (and kids typing) put in front of the actual topic
+TOPIC_PREFIXES = (
+    "i want to learn about",
+    "i want to learn",
+    "i'd like to learn about",
+    "i would like to learn about",
+    "can you teach me about",
+    "teach me about",
+    "tell me about",
+    "let's learn about",
+    "lets learn about",
+    "quiz me on",
+    "quiz me about",
+    "a quiz about",
+    "quiz about",
+    "learn about",
+    "about",
+)
+
+ARTICLES = ("the", "a", "an", "some")
+
+# Words that end in "s" but are not plurals we should strip
+SINGULAR_S_ENDINGS = ("ss", "us", "is", "os", "as")
+
+# Age bands share a cached quiz; questions for an 8 and a 9 year old
+# are close enough, a 5 and a 12 year old are not.
+AGE_BANDS = ((0, 6), (7, 8), (9, 10), (11, 12), (13, 200))
+
+
+def _singularize(word):
+    if len(word) <= 3 or word.endswith(SINGULAR_S_ENDINGS):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "sses", "zes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def normalize_topic(topic):
+    """Reduce a free-form topic to a stable cache key.
+
+    "I want to learn about Dinosaurs!" and "dinosaur" both become "dinosaur".
+    """
+    text = (topic or "").lower().strip()
+    text = re.sub(r"[^\w\s']", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+
+    for prefix in TOPIC_PREFIXES:
+        if text.startswith(prefix + " "):
+            text = text[len(prefix) + 1:]
+            break
+
+    words = text.split(" ")
+    while len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+
+    return " ".join(_singularize(word) for word in words if word)
+
+
+def age_band(age):
+    """Map an age to the label of the band it falls into, e.g. "7-8"."""
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        age = 8
+    for low, high in AGE_BANDS:
+        if low <= age <= high:
+            return f"{low}-{high}"
+    low, high = AGE_BANDS[-1]
+    return f"{low}-{high}"
+
+
+def cache_key(topic, age):
+    return (normalize_topic(topic), age_band(age))
+
+
+class QuizCache:
+    """Thread-safe LRU cache of generated quizzes with a TTL.
+
+    Each key holds up to ``variants`` different quizzes. Until a key has
+    that many, ``get`` reports a miss so the caller generates another one;
+    once full, a random variant is served.
+    """
+
+    def __init__(self, max_size=512, ttl=3600, variants=1):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.variants = max(1, variants)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                variants = [(created, quiz) for created, quiz in entry if now - created < self.ttl]
+                if variants:
+                    self._entries[key] = variants
+                    self._entries.move_to_end(key)
+                else:
+                    del self._entries[key]
+                if len(variants) >= self.variants:
+                    self.hits += 1
+                    return random.choice(variants)[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, quiz):
+        if self.max_size <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            variants = self._entries.get(key, [])
+            variants.append((now, quiz))
+            if len(variants) > self.variants:
+                variants = variants[-self.variants:]
+            self._entries[key] = variants
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'variants': self.variants,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class StreamFlight:
+    """Items one leader produces, replayed to followers as they arrive."""
+
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.result = None
+        self._cond = threading.Condition()
+
+    def publish(self, item):
+        with self._cond:
+            self.items.append(item)
+            self._cond.notify_all()
+
+    def finish(self, result=None):
+        """Mark the flight over; only the first call's result is kept."""
+        with self._cond:
+            if not self.done:
+                self.done = True
+                self.result = result
+            self._cond.notify_all()
+
+    def follow(self, timeout=None):
+        """Yield every item, past and future; TimeoutError if not done within ``timeout``."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        index = 0
+        while True:
+            with self._cond:
+                ready = self._cond.wait_for(
+                    lambda: self.done or len(self.items) > index,
+                    None if deadline is None else max(0.0, deadline - time.monotonic())
+                )
+                if not ready:
+                    raise TimeoutError("Timed out following an in-flight stream")
+                items = self.items[index:]
+                done = self.done
+            index += len(items)
+            yield from items
+            if done:
+                return
+
+
+class WaitersFull(TimeoutError):
+    """Too many callers are already waiting on in-flight calls."""
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one.
+
+    The first caller for a key runs ``fn``; callers arriving while it is
+    still running wait for its result instead of starting their own. At most
+    ``max_waiters`` callers (across all keys) may wait at once, since each
+    one holds a request thread; the rest raise ``WaitersFull`` right away.
+    """
+
+    def __init__(self, max_waiters=None):
+        self.max_waiters = max_waiters
+        self.leaders = 0
+        self.shared = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.waiting = 0
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """Return ``fn()`` for ``key``, sharing a call already in flight.
+
+        Waiting callers raise ``TimeoutError`` after ``timeout`` seconds;
+        the leader always runs ``fn`` to completion.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            elif self.max_waiters is not None and self.waiting >= self.max_waiters:
+                self.rejected += 1
+                raise WaitersFull(f"{self.waiting} callers already waiting on in-flight calls")
+            else:
+                self.shared += 1
+                self.waiting += 1
+                leader = False
+
+        if not leader:
+            finished = call.event.wait(timeout)
+            with self._lock:
+                self.waiting -= 1
+                if not finished:
+                    self.timeouts += 1
+            if not finished:
+                raise TimeoutError(f"Timed out waiting for in-flight call {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    @contextmanager
+    def stream(self, key):
+        """Share one streamed generation per key; yields ``(flight, leader)``.
+
+        The leader publishes each item to the StreamFlight and finishes it
+        with a result; followers read with ``flight.follow(timeout)``. Followers
+        count against ``max_waiters`` like ``do`` waiters (WaitersFull when
+        over). The flight is finished when the leader leaves, whatever happened.
+        """
+        with self._lock:
+            flight = self._streams.get(key)
+            if flight is None:
+                flight = self._streams[key] = StreamFlight()
+                self.leaders += 1
+                leader = True
+            elif self.max_waiters is not None and self.waiting >= self.max_waiters:
+                self.rejected += 1
+                raise WaitersFull(f"{self.waiting} callers already waiting on in-flight calls")
+            else:
+                self.shared += 1
+                self.waiting += 1
+                leader = False
+        try:
+            yield flight, leader
+        finally:
+            with self._lock:
+                if not leader:
+                    self.waiting -= 1
+                elif self._streams.get(key) is flight:
+                    del self._streams[key]
+            if leader:
+                flight.finish()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls) + len(self._streams),
+                'waiting': self.waiting,
+                'leaders': self.leaders,
+                'shared': self.shared,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected
+            }
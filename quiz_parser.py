@@ -0,0 +1,330 @@
+import json
+import re
+
+MIN_OPTIONS = 2
+MAX_OPTIONS = 4
+
+DEFAULT_EXPLANATION = "Great thinking! Keep exploring to learn even more amazing things! 🌟"
+
+# "A) Lions", "b. Tigers", "(C) Bears" -> the label is dropped
+OPTION_LABEL = re.compile(r'^\(?[A-Da-d][).:]\s+')
+
+# A complete JSON string, or a single brace
+JSON_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}]', re.DOTALL)
+
+# What a JSON object has to start with; anything else isn't worth decoding
+OBJECT_START = re.compile(r'\{\s*["}]')
+
+# After a span that never closes, how many '{' positions to retry from
+MAX_FALLBACK_STARTS = 8
+
+# A reply wrapped in a Markdown code fence
+CODE_FENCE = re.compile(r'^```[A-Za-z]*\s*(.*?)\s*```$', re.DOTALL)
+
+
+class QuizParseError(ValueError):
+    """A model response that couldn't be turned into a quiz.
+
+    ``reason`` is one of 'empty', 'invalid_json' or 'bad_structure'.
+    """
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _span_end(text, start):
+    """Index just past the ``}`` that closes the ``{`` at start, or None.
+
+    Strings are matched whole by the regex, so braces inside them don't
+    count and ordinary characters are skipped in C rather than one by one.
+    """
+    depth = 0
+    for match in JSON_TOKEN.finditer(text, start):
+        token = match.group()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return None
+
+
+def extract_json_object(text, key=None):
+    """Return the first JSON object found in a model response.
+
+    Handles bare JSON, code-fenced JSON and JSON surrounded by prose. With
+    ``key``, objects without that key (an example, an empty ``{}``) are
+    skipped and the scan goes on. Each top-level ``{...}`` span is tried
+    once with the C decoder and skipped as a whole if it isn't what we want,
+    so the work is linear in the response length. Raises QuizParseError
+    when there is no text or no suitable object.
+    """
+    if not text or not text.strip():
+        raise QuizParseError('empty', "Empty response from API")
+
+    found = []
+
+    def wanted(data):
+        if not isinstance(data, dict):
+            return False
+        found.append(True)
+        return key is None or key in data
+
+    stripped = text.strip()
+    if stripped.startswith('{') and stripped.endswith('}'):
+        try:
+            data = json.loads(stripped)
+            if wanted(data):
+                return data
+        except (json.JSONDecodeError, RecursionError):
+            pass
+
+    decoder = json.JSONDecoder()
+    pos = text.find('{')
+    while pos != -1:
+        end = None
+        # Only decode plausible objects: a failed raw_decode counts the lines
+        # before pos for its error message, which adds up over many spans.
+        if OBJECT_START.match(text, pos):
+            try:
+                data, end = decoder.raw_decode(text, pos)
+                if wanted(data):
+                    return data
+            except (json.JSONDecodeError, RecursionError):
+                # Deeply nested input overflows the decoder's recursion
+                pass
+        if end is None:
+            end = _span_end(text, pos)
+            if end is None:
+                break
+        pos = text.find('{', end)
+
+    if pos != -1:
+        # A stray '{' in the prose never closed and hid the real object;
+        # retry from the next few openings instead.
+        for _ in range(MAX_FALLBACK_STARTS):
+            pos = text.find('{', pos + 1)
+            if pos == -1:
+                break
+            if not OBJECT_START.match(text, pos):
+                continue
+            try:
+                data, _ = decoder.raw_decode(text, pos)
+            except (json.JSONDecodeError, RecursionError):
+                continue
+            if wanted(data):
+                return data
+
+    if found:
+        raise QuizParseError('bad_structure', f"No JSON object with {key!r} in API response")
+    raise QuizParseError('invalid_json', "No valid JSON object in API response")
+
+
+def extract_json_array(text):
+    """Return a reply that is just a JSON array (maybe code-fenced), or None."""
+    stripped = (text or '').strip()
+    fenced = CODE_FENCE.match(stripped)
+    if fenced:
+        stripped = fenced.group(1)
+    if not (stripped.startswith('[') and stripped.endswith(']')):
+        return None
+    try:
+        data = json.loads(stripped)
+    except (json.JSONDecodeError, RecursionError):
+        return None
+    return data if isinstance(data, list) else None
+
+
+def _correct_index(value, options):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        if len(value) == 1 and value.upper() in 'ABCD':
+            return 'ABCD'.index(value.upper())
+        label = OPTION_LABEL.sub('', value).strip().lower()
+        for index, option in enumerate(options):
+            if option.lower() == label:
+                return index
+    return None
+
+
+def repair_question(raw):
+    """Return a clean copy of a question, or None if it can't be salvaged.
+
+    Fixes what's safe to fix: option labels like "A) ", numeric or lettered
+    answers, extra options after the correct one, a missing explanation.
+    """
+    if not isinstance(raw, dict):
+        return None
+
+    text = raw.get('question')
+    if not isinstance(text, str) or not text.strip():
+        return None
+
+    raw_options = raw.get('options')
+    if not isinstance(raw_options, list):
+        return None
+    # Unusable options become '' so indexes still match the model's answer key
+    cleaned = [
+        OPTION_LABEL.sub('', str(option)).strip()
+        if isinstance(option, (str, int, float)) and not isinstance(option, bool) else ''
+        for option in raw_options
+    ]
+
+    correct = _correct_index(raw.get('correct_answer'), cleaned)
+    if correct is None or not 0 <= correct < len(cleaned) or not cleaned[correct]:
+        return None
+    # Drop the empty ones and move the answer index along with its option
+    correct = sum(1 for option in cleaned[:correct] if option)
+    options = [option for option in cleaned if option]
+    if len(options) > MAX_OPTIONS:
+        if correct >= MAX_OPTIONS:
+            return None
+        options = options[:MAX_OPTIONS]
+    if len(options) < MIN_OPTIONS:
+        return None
+
+    explanation = raw.get('explanation')
+    if not isinstance(explanation, str) or not explanation.strip():
+        explanation = DEFAULT_EXPLANATION
+
+    return {
+        'question': text.strip(),
+        'options': options,
+        'correct_answer': correct,
+        'explanation': explanation.strip()
+    }
+
+
+def validate_quiz(quiz_data, min_questions=1):
+    """Repair every question in a parsed quiz and keep the ones that survive.
+
+    Returns (quiz, dropped) where quiz is ``{'questions': [...]}``. Raises
+    QuizParseError if fewer than ``min_questions`` questions are usable.
+    """
+    if isinstance(quiz_data, list):
+        quiz_data = {'questions': quiz_data}
+    if not isinstance(quiz_data, dict) or not isinstance(quiz_data.get('questions'), list):
+        raise QuizParseError('bad_structure', "Invalid quiz data structure")
+
+    questions = []
+    for raw in quiz_data['questions']:
+        question = repair_question(raw)
+        if question is not None:
+            questions.append(question)
+    if len(questions) < max(1, min_questions):
+        raise QuizParseError('bad_structure', "No usable questions in quiz data")
+    return {'questions': questions}, len(quiz_data['questions']) - len(questions)
+
+
+def parse_quiz_response(text, min_questions=1):
+    """Turn a single-quiz model response into ``({'questions': [...]}, dropped)``.
+
+    Besides an object with a ``questions`` key, a reply that is a bare array
+    of questions is accepted too.
+    """
+    try:
+        quiz_data = extract_json_object(text, 'questions')
+    except QuizParseError:
+        quiz_data = extract_json_array(text)
+        if quiz_data is None:
+            raise
+    return validate_quiz(quiz_data, min_questions)
+
+
+def parse_batch_response(text):
+    """Return the raw quiz entries of a batch response; validate each with validate_quiz."""
+    data = extract_json_object(text, 'quizzes')
+    quizzes = data.get('quizzes')
+    if not isinstance(quizzes, list):
+        raise QuizParseError('bad_structure', "Invalid batch quiz structure")
+    return quizzes
+
+
+class QuestionStreamParser:
+    """Incrementally pull complete questions out of a streamed quiz response.
+
+    Feed it text chunks as they arrive; each call returns the questions whose
+    closing brace has been seen since the last call. Every character is
+    scanned once, so the total cost is linear in the response length.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._start = None
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def done(self):
+        return self._done
+
+    def feed(self, text):
+        self._buffer += text
+        questions = []
+
+        if not self._in_array and not self._done:
+            key = self._buffer.find('"questions"')
+            if key == -1:
+                return questions
+            bracket = self._buffer.find('[', key)
+            if bracket == -1:
+                return questions
+            self._in_array = True
+            self._pos = bracket + 1
+
+        while self._in_array and self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                if self._depth == 0:
+                    self._start = self._pos
+                self._depth += 1
+            elif char == '}' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    question = self._decode(self._buffer[self._start:self._pos + 1])
+                    if question is not None:
+                        questions.append(question)
+                    self._start = None
+            elif char == ']' and self._depth == 0:
+                self._in_array = False
+                self._done = True
+            self._pos += 1
+
+        # Drop text that has been fully consumed so the buffer stays small
+        keep = self._start if self._start is not None else self._pos
+        self._buffer = self._buffer[keep:]
+        self._pos -= keep
+        if self._start is not None:
+            self._start = 0
+
+        return questions
+
+    @staticmethod
+    def _decode(text):
+        try:
+            return repair_question(json.loads(text))
+        except (json.JSONDecodeError, RecursionError):
+            return None
@@ -0,0 +1,179 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+from quiz_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token bucket shared by the pool workers so warm-up stays within quota."""
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _PoolEntry:
+    __slots__ = ('topic', 'age', 'quizzes', 'queued')
+
+    def __init__(self, topic, age):
+        self.topic = topic
+        self.age = age
+        self.quizzes = deque()
+        self.queued = False
+
+
+class QuizPool:
+    """Keeps a few ready-made quizzes per (topic, age band).
+
+    ``generate(topic, age)`` is called from background worker threads to fill
+    each registered key up to ``target``; a refill is queued whenever a key
+    drops to ``low_water`` or below. ``pop`` never blocks on the model.
+    Beyond ``max_keys`` the key popped least recently is dropped, so topics
+    that become popular later still get a place.
+    """
+
+    def __init__(self, generate, target=3, low_water=1, workers=2, rate_per_minute=30, max_keys=256):
+        self.generate = generate
+        self.target = target
+        self.low_water = low_water
+        self.max_keys = max_keys
+        self.limiter = RateLimiter(rate_per_minute)
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failures = 0
+        self.refill_count = 0
+        self.refill_seconds = 0.0
+        self.refill_max_seconds = 0.0
+        self.refill_last_seconds = 0.0
+        self.evicted = 0
+        # Ordered from least to most recently popped
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._run, name=f"quiz-pool-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def register(self, topic, age):
+        """Start keeping quizzes for this topic and age; returns False if it can't be pooled."""
+        key = cache_key(topic, age)
+        if not key[0] or self.max_keys <= 0:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                while len(self._entries) >= self.max_keys:
+                    evicted_key, _ = self._entries.popitem(last=False)
+                    self.evicted += 1
+                    logger.info(f"Quiz pool dropped {evicted_key} to make room")
+                entry = self._entries[key] = _PoolEntry(topic, age)
+            self._schedule(key, entry)
+        return True
+
+    def pop(self, topic, age):
+        key = cache_key(topic, age)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            if entry is None or not entry.quizzes:
+                self.misses += 1
+                if entry is not None:
+                    self._schedule(key, entry)
+                return None
+            self.hits += 1
+            quiz = entry.quizzes.popleft()
+            self._schedule(key, entry)
+            return quiz
+
+    def clear(self):
+        """Forget every key and ready quiz; queued or running refills are dropped."""
+        with self._lock:
+            self._entries.clear()
+
+    def _schedule(self, key, entry):
+        # Caller holds self._lock
+        if not entry.queued and len(entry.quizzes) <= self.low_water:
+            entry.queued = True
+            self._queue.put(key)
+
+    def _run(self):
+        while True:
+            key = self._queue.get()
+            try:
+                self._refill(key)
+            except Exception as e:
+                logger.error(f"Quiz pool refill failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        entry.queued = False
+
+    def _refill(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            # Evicted while waiting in the queue
+            return
+        while len(entry.quizzes) < self.target:
+            self.limiter.acquire()
+            started = time.monotonic()
+            quiz = self.generate(entry.topic, entry.age)
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.refill_count += 1
+                self.refill_seconds += elapsed
+                self.refill_last_seconds = elapsed
+                self.refill_max_seconds = max(self.refill_max_seconds, elapsed)
+                if quiz is None:
+                    self.failures += 1
+                    return
+                self.generated += 1
+                entry.quizzes.append(quiz)
+                if self._entries.get(key) is not entry:
+                    return
+        logger.info(f"Quiz pool refilled {key} to {len(entry.quizzes)}")
+
+    def stats(self):
+        with self._lock:
+            depths = {f"{topic}|{band}": len(entry.quizzes) for (topic, band), entry in self._entries.items()}
+            return {
+                'keys': len(self._entries),
+                'evicted': self.evicted,
+                'depth': sum(depths.values()),
+                'depth_by_key': depths,
+                'queued_refills': self._queue.qsize(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'generated': self.generated,
+                'failures': self.failures,
+                'refill_avg_seconds': round(self.refill_seconds / self.refill_count, 4) if self.refill_count else 0.0,
+                'refill_max_seconds': round(self.refill_max_seconds, 4),
+                'refill_last_seconds': round(self.refill_last_seconds, 4)
+            }
@@ -4,5 +4,5 @@
 npm install
 npm run build
 
-# Start Flask app
-python app.py
+# Start Flask app with the production server
+gunicorn -c gunicorn.conf.py app:app
@@ -0,0 +1,562 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class SessionNotFound(KeyError):
+    pass
+
+
+class QuizCompleted(Exception):
+    pass
+
+
+class QuestionNotReady(Exception):
+    """The session is still streaming and the next question hasn't arrived."""
+
+
+def new_id(prefix):
+    # Random ids stay unique across worker processes and restarts
+    return f"{prefix}_{uuid.uuid4().hex}"
+
+
+def _answer_result(question, is_correct, score, current_question, total, generating):
+    return {
+        'is_correct': is_correct,
+        'explanation': question['explanation'],
+        'score': score,
+        'current_question': current_question,
+        'total_questions': total,
+        'is_quiz_complete': not generating and current_question >= total
+    }
+
+
+class SessionLimits:
+    """When sessions expire and how many are kept.
+
+    Sessions nobody has touched for ``idle_timeout`` seconds and finished
+    quizzes older than ``completed_ttl`` are dropped; beyond ``max_sessions``
+    the least recently active ones are evicted. Expired sessions are swept
+    lazily, at most once every ``sweep_interval`` seconds.
+    """
+
+    def __init__(self, max_sessions=10000, idle_timeout=1800, completed_ttl=600, sweep_interval=30):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.completed_ttl = completed_ttl
+        self.sweep_interval = sweep_interval
+
+    def expired(self, last_active, completed_at, now):
+        if completed_at is not None and now - completed_at > self.completed_ttl:
+            return True
+        return now - last_active > self.idle_timeout
+
+
+class QuizInterner:
+    """Share one immutable copy of each question list between sessions.
+
+    Sessions started from the same cached quiz are handed the very same list
+    object, so entries are keyed by its identity: acquiring is a dict lookup,
+    with no hashing of the questions under the store lock. Entries keep the
+    list alive (so its id can't be reused) and are reference counted, freed
+    when the last session using them goes away.
+    """
+
+    def __init__(self):
+        self._quizzes = {}
+
+    def acquire(self, questions):
+        key = id(questions)
+        entry = self._quizzes.get(key)
+        if entry is None:
+            entry = self._quizzes[key] = [questions, tuple(questions), 0]
+        entry[2] += 1
+        return key, entry[1]
+
+    def release(self, key):
+        entry = self._quizzes.get(key)
+        if entry is not None:
+            entry[2] -= 1
+            if entry[2] <= 0:
+                del self._quizzes[key]
+
+    def __len__(self):
+        return len(self._quizzes)
+
+
+class _Session:
+    __slots__ = (
+        'id', 'profile_id', 'topic', 'quiz_key', 'questions', 'current_question',
+        'score', 'answers', 'generating', 'last_active', 'completed_at'
+    )
+
+    def to_dict(self):
+        session = {
+            'id': self.id,
+            'profile_id': self.profile_id,
+            'topic': self.topic,
+            'questions': list(self.questions),
+            'current_question': self.current_question,
+            'score': self.score,
+            'answers': [
+                {'question_index': q, 'answer_index': a, 'is_correct': c}
+                for q, a, c in self.answers
+            ]
+        }
+        if self.generating:
+            session['generating'] = True
+        return session
+
+
+class MemoryStore:
+    """Profiles and sessions kept in this process. Fine for a single worker.
+
+    Sessions are compact ``__slots__`` records, ordered by last activity,
+    whose questions point at a shared interned quiz; answers are tuples.
+    """
+
+    backend = 'memory'
+
+    def __init__(self, limits=None):
+        self.limits = limits or SessionLimits()
+        self.expired = 0
+        self.evicted = 0
+        self._profiles = {}
+        self._sessions = OrderedDict()
+        self._quizzes = QuizInterner()
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_profile(self, profile):
+        with self._lock:
+            self._profiles[profile['id']] = profile
+
+    def get_profile(self, profile_id):
+        with self._lock:
+            profile = self._profiles.get(profile_id)
+            return dict(profile) if profile is not None else None
+
+    def add_session(self, session):
+        now = time.monotonic()
+        record = _Session()
+        record.id = session['id']
+        record.profile_id = session['profile_id']
+        record.topic = session['topic']
+        record.current_question = session['current_question']
+        record.score = session['score']
+        record.answers = [
+            (a['question_index'], a['answer_index'], a['is_correct']) for a in session['answers']
+        ]
+        record.generating = bool(session.get('generating'))
+        record.last_active = now
+        record.completed_at = None
+        with self._lock:
+            if record.generating:
+                # Still growing; interned once generation finishes
+                record.quiz_key = None
+                record.questions = list(session['questions'])
+            else:
+                record.quiz_key, record.questions = self._quizzes.acquire(session['questions'])
+            self._sessions[record.id] = record
+            self._maybe_sweep(now)
+
+    def _get_live(self, session_id, now):
+        # Caller holds self._lock
+        record = self._sessions.get(session_id)
+        if record is None:
+            return None
+        if self.limits.expired(record.last_active, record.completed_at, now):
+            self._remove(record)
+            self.expired += 1
+            return None
+        return record
+
+    def _remove(self, record):
+        # Caller holds self._lock
+        del self._sessions[record.id]
+        if record.quiz_key is not None:
+            self._quizzes.release(record.quiz_key)
+
+    def _maybe_sweep(self, now):
+        # Caller holds self._lock
+        if now - self._last_sweep >= self.limits.sweep_interval:
+            self._sweep(now)
+        while len(self._sessions) > self.limits.max_sessions:
+            _, record = self._sessions.popitem(last=False)
+            if record.quiz_key is not None:
+                self._quizzes.release(record.quiz_key)
+            self.evicted += 1
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        stale = [
+            record for record in self._sessions.values()
+            if self.limits.expired(record.last_active, record.completed_at, now)
+        ]
+        for record in stale:
+            self._remove(record)
+        self.expired += len(stale)
+        return len(stale)
+
+    def sweep(self):
+        """Drop every expired session now; returns how many were removed."""
+        with self._lock:
+            return self._sweep(time.monotonic())
+
+    def get_session(self, session_id):
+        with self._lock:
+            record = self._get_live(session_id, time.monotonic())
+            return record.to_dict() if record is not None else None
+
+    def append_question(self, session_id, question):
+        now = time.monotonic()
+        with self._lock:
+            record = self._get_live(session_id, now)
+            if record is None:
+                raise SessionNotFound(session_id)
+            record.questions.append(question)
+            record.last_active = now
+
+    def finish_generation(self, session_id, fallback_questions=None):
+        """Mark a streamed session complete, filling it in if nothing arrived."""
+        with self._lock:
+            record = self._get_live(session_id, time.monotonic())
+            if record is None:
+                raise SessionNotFound(session_id)
+            if record.generating:
+                questions = record.questions or list(fallback_questions or [])
+                record.quiz_key, record.questions = self._quizzes.acquire(questions)
+                record.generating = False
+
+    def record_answer(self, session_id, answer_index):
+        now = time.monotonic()
+        with self._lock:
+            record = self._get_live(session_id, now)
+            if record is None:
+                raise SessionNotFound(session_id)
+            current_q = record.current_question
+            total = len(record.questions)
+            if current_q >= total:
+                if record.generating:
+                    raise QuestionNotReady(session_id)
+                raise QuizCompleted(session_id)
+
+            question = record.questions[current_q]
+            is_correct = answer_index == question['correct_answer']
+            if is_correct:
+                record.score += 1
+            record.answers.append((current_q, answer_index, is_correct))
+            record.current_question = current_q + 1
+            record.last_active = now
+            self._sessions.move_to_end(session_id)
+            if not record.generating and record.current_question >= total:
+                record.completed_at = now
+            return _answer_result(question, is_correct, record.score, record.current_question, total, record.generating)
+
+    def count_profiles(self):
+        with self._lock:
+            return len(self._profiles)
+
+    def count_sessions(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.backend,
+                'profiles': len(self._profiles),
+                'sessions': len(self._sessions),
+                'max_sessions': self.limits.max_sessions,
+                'shared_quizzes': len(self._quizzes),
+                'expired': self.expired,
+                'evicted': self.evicted
+            }
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    profile_id TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    questions TEXT NOT NULL,
+    current_question INTEGER NOT NULL DEFAULT 0,
+    score INTEGER NOT NULL DEFAULT 0,
+    answers TEXT NOT NULL DEFAULT '[]',
+    generating INTEGER NOT NULL DEFAULT 0,
+    last_active REAL NOT NULL DEFAULT 0,
+    completed_at REAL
+);
+"""
+
+# Columns added after the first release of the sessions table
+MIGRATIONS = (
+    ('last_active', "ALTER TABLE sessions ADD COLUMN last_active REAL NOT NULL DEFAULT 0"),
+    ('completed_at', "ALTER TABLE sessions ADD COLUMN completed_at REAL"),
+)
+
+INDEXES = "CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active)"
+
+# Statements are kept as constants with ? placeholders so sqlite3's
+# per-connection statement cache reuses the compiled form.
+INSERT_PROFILE = "INSERT INTO profiles (id, data) VALUES (?, ?)"
+SELECT_PROFILE = "SELECT data FROM profiles WHERE id = ?"
+INSERT_SESSION = (
+    "INSERT INTO sessions (id, profile_id, topic, questions, current_question, score, answers, generating, last_active) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SELECT_SESSION = (
+    "SELECT id, profile_id, topic, questions, current_question, score, answers, generating, last_active, completed_at "
+    "FROM sessions WHERE id = ?"
+)
+UPDATE_QUESTIONS = "UPDATE sessions SET questions = ?, generating = ?, last_active = ? WHERE id = ?"
+UPDATE_ANSWER = (
+    "UPDATE sessions SET current_question = ?, score = ?, answers = ?, last_active = ?, completed_at = ? "
+    "WHERE id = ?"
+)
+DELETE_SESSION = "DELETE FROM sessions WHERE id = ?"
+DELETE_EXPIRED = "DELETE FROM sessions WHERE last_active < ? OR completed_at < ?"
+DELETE_OLDEST = (
+    "DELETE FROM sessions WHERE id IN "
+    "(SELECT id FROM sessions ORDER BY last_active LIMIT ?)"
+)
+DELETE_OVERFLOW = (
+    "DELETE FROM sessions WHERE id IN "
+    "(SELECT id FROM sessions ORDER BY last_active DESC LIMIT -1 OFFSET ?)"
+)
+COUNT_PROFILES = "SELECT COUNT(*) FROM profiles"
+COUNT_SESSIONS = "SELECT COUNT(*) FROM sessions"
+
+
+class SQLiteStore:
+    """Profiles and sessions in a SQLite file shared by every worker process.
+
+    The database runs in WAL mode so readers don't block the writer. Each
+    thread reuses its own connection, and read-modify-write updates run
+    inside ``BEGIN IMMEDIATE`` so concurrent answers can't lose a score.
+    Timestamps are wall-clock so every process agrees on expiry.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, path='quiz.db', timeout=10.0, limits=None):
+        self.path = path
+        self.timeout = timeout
+        self.limits = limits or SessionLimits()
+        self.expired = 0
+        self.evicted = 0
+        self._last_sweep = time.time()
+        self._sweep_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+            for column, statement in MIGRATIONS:
+                if column not in columns:
+                    conn.execute(statement)
+            conn.execute(INDEXES)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=128
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._local.conn = conn
+        return _Transaction(conn)
+
+    def add_profile(self, profile):
+        with self._connect() as conn:
+            conn.execute(INSERT_PROFILE, (profile['id'], json.dumps(profile)))
+
+    def get_profile(self, profile_id):
+        with self._connect() as conn:
+            row = conn.execute(SELECT_PROFILE, (profile_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_session(self, session):
+        now = time.time()
+        with self._connect() as conn:
+            # The cap is enforced in the insert's own transaction, not just
+            # by the periodic sweep, so no process can push past it
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(INSERT_SESSION, (
+                session['id'],
+                session['profile_id'],
+                session['topic'],
+                json.dumps(session['questions']),
+                session['current_question'],
+                session['score'],
+                json.dumps(session['answers']),
+                1 if session.get('generating') else 0,
+                now
+            ))
+            overflow = conn.execute(COUNT_SESSIONS).fetchone()[0] - self.limits.max_sessions
+            evicted = conn.execute(DELETE_OLDEST, (overflow,)).rowcount if overflow > 0 else 0
+        self.evicted += evicted
+        self._maybe_sweep(now)
+
+    def _maybe_sweep(self, now):
+        if now - self._last_sweep < self.limits.sweep_interval:
+            return
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._sweep(now)
+        finally:
+            self._sweep_lock.release()
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            removed = conn.execute(DELETE_EXPIRED, (
+                now - self.limits.idle_timeout,
+                now - self.limits.completed_ttl
+            )).rowcount
+            evicted = conn.execute(DELETE_OVERFLOW, (self.limits.max_sessions,)).rowcount
+        self.expired += removed
+        self.evicted += evicted
+        return removed
+
+    def sweep(self):
+        """Drop every expired session now; returns how many were removed."""
+        with self._sweep_lock:
+            return self._sweep(time.time())
+
+    @staticmethod
+    def _row_to_session(row):
+        session = {
+            'id': row[0],
+            'profile_id': row[1],
+            'topic': row[2],
+            'questions': json.loads(row[3]),
+            'current_question': row[4],
+            'score': row[5],
+            'answers': json.loads(row[6])
+        }
+        if row[7]:
+            session['generating'] = True
+        return session
+
+    def _live_row(self, conn, session_id):
+        row = conn.execute(SELECT_SESSION, (session_id,)).fetchone()
+        if row is not None and self.limits.expired(row[8], row[9], time.time()):
+            # Another process may have removed it first; count it only once
+            if conn.execute(DELETE_SESSION, (session_id,)).rowcount:
+                self.expired += 1
+            return None
+        return row
+
+    def get_session(self, session_id):
+        with self._connect() as conn:
+            row = self._live_row(conn, session_id)
+        return self._row_to_session(row) if row else None
+
+    def _locked_session(self, conn, session_id):
+        conn.execute("BEGIN IMMEDIATE")
+        row = self._live_row(conn, session_id)
+        if row is None:
+            # Commit the expiry delete now; raising would roll it back
+            conn.execute("COMMIT")
+            raise SessionNotFound(session_id)
+        return self._row_to_session(row)
+
+    def append_question(self, session_id, question):
+        with self._connect() as conn:
+            session = self._locked_session(conn, session_id)
+            session['questions'].append(question)
+            conn.execute(UPDATE_QUESTIONS, (
+                json.dumps(session['questions']),
+                1 if session.get('generating') else 0,
+                time.time(),
+                session_id
+            ))
+
+    def finish_generation(self, session_id, fallback_questions=None):
+        with self._connect() as conn:
+            session = self._locked_session(conn, session_id)
+            questions = session['questions'] or list(fallback_questions or [])
+            conn.execute(UPDATE_QUESTIONS, (json.dumps(questions), 0, time.time(), session_id))
+
+    def record_answer(self, session_id, answer_index):
+        with self._connect() as conn:
+            session = self._locked_session(conn, session_id)
+            current_q = session['current_question']
+            total = len(session['questions'])
+            generating = session.get('generating', False)
+            if current_q >= total:
+                if generating:
+                    raise QuestionNotReady(session_id)
+                raise QuizCompleted(session_id)
+
+            question = session['questions'][current_q]
+            is_correct = answer_index == question['correct_answer']
+            score = session['score'] + (1 if is_correct else 0)
+            session['answers'].append({
+                'question_index': current_q,
+                'answer_index': answer_index,
+                'is_correct': is_correct
+            })
+            now = time.time()
+            completed_at = now if not generating and current_q + 1 >= total else None
+            conn.execute(UPDATE_ANSWER, (current_q + 1, score, json.dumps(session['answers']), now, completed_at, session_id))
+            return _answer_result(question, is_correct, score, current_q + 1, total, generating)
+
+    def count_profiles(self):
+        with self._connect() as conn:
+            return conn.execute(COUNT_PROFILES).fetchone()[0]
+
+    def count_sessions(self):
+        with self._connect() as conn:
+            return conn.execute(COUNT_SESSIONS).fetchone()[0]
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'profiles': self.count_profiles(),
+            'sessions': self.count_sessions(),
+            'max_sessions': self.limits.max_sessions,
+            'expired': self.expired,
+            'evicted': self.evicted
+        }
+
+
+class _Transaction:
+    """Commit an explicit transaction on success, roll it back on error."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.conn.in_transaction:
+            if exc_type is None:
+                self.conn.execute("COMMIT")
+            else:
+                self.conn.execute("ROLLBACK")
+        return False
+
+
+def create_store(backend='memory', sqlite_path='quiz.db', limits=None):
+    if backend == 'memory':
+        return MemoryStore(limits)
+    if backend == 'sqlite':
+        return SQLiteStore(sqlite_path, limits=limits)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings app.py reads at import time: no background pool, no real Gemini key
+os.environ['QUIZ_POOL_ENABLED'] = 'false'
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ.pop('GEMINI_API_KEY', None)
+
+
+@pytest.fixture
+def quiz_app(monkeypatch):
+    """app.py with empty quiz caches; set ``quiz_app.model`` to a fake in the test."""
+    import app as quiz_app
+    from quiz_cache import SingleFlight
+
+    quiz_app.quiz_cache.clear()
+    monkeypatch.setattr(quiz_app, 'quiz_inflight', SingleFlight())
+    monkeypatch.setattr(quiz_app, 'model', None)
+    return quiz_app
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.fake_gemini import FakeGenerativeModel
+from quiz_cache import SingleFlight
+
+
+def generate_concurrently(quiz_app, topic, count):
+    """POST /api/quiz/generate ``count`` times at once; returns the JSON replies."""
+    client = quiz_app.app.test_client()
+    profile_id = client.post('/api/profile', json={'name': 'Test', 'age': 8}).get_json()['profile']['id']
+    start = threading.Barrier(count)
+    replies = [None] * count
+
+    def request(index):
+        start.wait()
+        response = quiz_app.app.test_client().post(
+            '/api/quiz/generate', json={'topic': topic, 'profile_id': profile_id}
+        )
+        replies[index] = response.get_json()
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    return replies
+
+
+def is_model_quiz(quiz):
+    return quiz['questions'][0]['question'].startswith('Can you guess fact')
+
+
+def test_identical_requests_share_one_model_call(quiz_app, monkeypatch):
+    monkeypatch.setattr(quiz_app, 'model', FakeGenerativeModel(latency=0.3, jitter=0.0, seed=1))
+
+    replies = generate_concurrently(quiz_app, 'volcanoes', 10)
+
+    assert quiz_app.model.calls == 1
+    assert all(reply['success'] for reply in replies)
+    assert len({reply['session_id'] for reply in replies}) == 10
+    assert all(is_model_quiz(reply['quiz']) for reply in replies)
+
+
+def test_waiters_fall_back_to_mock_after_timeout(quiz_app, monkeypatch):
+    monkeypatch.setattr(quiz_app, 'model', FakeGenerativeModel(latency=1.0, jitter=0.0, seed=1))
+    monkeypatch.setattr(quiz_app, 'QUIZ_INFLIGHT_TIMEOUT', 0.1)
+
+    replies = generate_concurrently(quiz_app, 'comets', 5)
+
+    assert quiz_app.model.calls == 1
+    assert all(reply['success'] for reply in replies)
+    assert len({reply['session_id'] for reply in replies}) == 5
+    # The leader waits for the model; everyone else gave up and got the mock quiz
+    assert sum(is_model_quiz(reply['quiz']) for reply in replies) == 1
+    assert quiz_app.quiz_inflight.stats()['timeouts'] == 4
+
+
+def test_extra_waiters_get_mock_quiz_at_once(quiz_app, monkeypatch):
+    monkeypatch.setattr(quiz_app, 'model', FakeGenerativeModel(latency=0.5, jitter=0.0, seed=1))
+    monkeypatch.setattr(quiz_app, 'quiz_inflight', SingleFlight(max_waiters=2))
+
+    replies = generate_concurrently(quiz_app, 'glaciers', 6)
+
+    assert quiz_app.model.calls == 1
+    assert all(reply['success'] for reply in replies)
+    # The leader and two waiters share the model quiz; the other three don't wait
+    assert sum(is_model_quiz(reply['quiz']) for reply in replies) == 3
+    assert quiz_app.quiz_inflight.stats()['rejected'] == 3
+    assert quiz_app.quiz_inflight.stats()['waiting'] == 0
+
+
+def test_identical_streams_share_one_model_call(quiz_app, monkeypatch):
+    monkeypatch.setattr(quiz_app, 'model', FakeGenerativeModel(latency=0.5, jitter=0.0, seed=1))
+    client = quiz_app.app.test_client()
+    profile_id = client.post('/api/profile', json={'name': 'Test', 'age': 8}).get_json()['profile']['id']
+    start = threading.Barrier(5)
+    bodies = [None] * 5
+
+    def request(index):
+        start.wait()
+        response = quiz_app.app.test_client().post(
+            '/api/quiz/generate/stream', json={'topic': 'tides', 'profile_id': profile_id}
+        )
+        bodies[index] = response.get_data(as_text=True)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert quiz_app.model.calls == 1
+    for body in bodies:
+        assert body.count('event: question') == 4
+        assert '"source": "model"' in body
+    assert quiz_app.quiz_inflight.stats()['shared'] == 4
+    assert quiz_app.quiz_inflight.stats()['in_flight'] == 0
+
+
+def test_waiters_share_the_leaders_error():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    errors = []
+
+    def fail():
+        calls.append(1)
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    def run():
+        try:
+            flight.do('key', fail, timeout=5)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while flight.stats()['in_flight'] == 0 or flight.stats()['shared'] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(calls) == 1
+    assert len(errors) == 4
+
+
+def test_waiter_times_out():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=('key', lambda: release.wait(5)))
+    leader.start()
+    while flight.stats()['in_flight'] == 0:
+        time.sleep(0.01)
+
+    with pytest.raises(TimeoutError):
+        flight.do('key', lambda: None, timeout=0.05)
+
+    release.set()
+    leader.join(timeout=5)
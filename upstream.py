@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+
+class UpstreamSaturated(Exception):
+    """Every upstream slot stayed busy for longer than the acquire timeout."""
+
+
+class UpstreamTimeout(Exception):
+    """The upstream call took longer than the call timeout."""
+
+
+class UpstreamGate:
+    """Bound how many model calls run at once and how long callers wait.
+
+    Calls run on a dedicated executor so the request thread can give up after
+    ``call_timeout`` without the slot being freed early: a slot is released
+    only when the underlying call really finishes. Callers that can't get a
+    slot within ``acquire_timeout`` fail fast with ``UpstreamSaturated``
+    instead of piling up behind the model.
+    """
+
+    def __init__(self, max_concurrent=8, acquire_timeout=2.0, call_timeout=30.0):
+        self.max_concurrent = max_concurrent
+        self.acquire_timeout = acquire_timeout
+        self.call_timeout = call_timeout
+        self.in_flight = 0
+        self.calls = 0
+        self.saturated = 0
+        self.timeouts = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='upstream')
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self.saturated += 1
+            raise UpstreamSaturated(f"All {self.max_concurrent} upstream slots busy")
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+
+    def _release(self, *_):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def call(self, fn, *args, **kwargs):
+        self._acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.call_timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise UpstreamTimeout(f"Upstream call exceeded {self.call_timeout}s")
+
+    def stream(self, fn, *args, **kwargs):
+        """Yield the chunks of the iterator ``fn`` returns, holding a slot.
+
+        The whole stream must finish within ``call_timeout``. Chunks are read
+        on the gate's executor so a stalled stream can be abandoned: on the
+        deadline UpstreamTimeout is raised to the caller. Whether it timed
+        out or the caller stopped reading, the reader stops after its pending
+        read returns, and like ``call`` the slot is only released then.
+        """
+        self._acquire()
+        chunks = queue.Queue()
+        abandoned = threading.Event()
+        end = object()
+
+        def pump():
+            iterator = None
+            try:
+                iterator = fn(*args, **kwargs)
+                for chunk in iterator:
+                    if abandoned.is_set():
+                        return
+                    chunks.put((chunk, None))
+                chunks.put((end, None))
+            except Exception as e:
+                chunks.put((end, e))
+            finally:
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+                self._release()
+
+        try:
+            self._executor.submit(pump)
+        except Exception:
+            self._release()
+            raise
+        deadline = time.monotonic() + self.call_timeout
+        try:
+            while True:
+                try:
+                    chunk, error = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise UpstreamTimeout(f"Upstream stream exceeded {self.call_timeout}s")
+                if error is not None:
+                    raise error
+                if chunk is end:
+                    return
+                yield chunk
+        finally:
+            abandoned.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'in_flight': self.in_flight,
+                'calls': self.calls,
+                'saturated': self.saturated,
+                'timeouts': self.timeouts
+            }